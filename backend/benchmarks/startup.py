@@ -0,0 +1,117 @@
+"""
+Startup benchmark: per-module import time and time to first request
+
+Run from the backend directory, e.g.
+`python benchmarks/startup.py --max-import-ms 800 --max-first-request-ms 5000`.
+Exits non-zero when a threshold is exceeded so CI can catch regressions.
+"""
+import sys
+import json
+import time
+import socket
+import subprocess
+import urllib.request
+from pathlib import Path
+from typing import List, Optional, Tuple
+import typer
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+app = typer.Typer(help="Measure backend import and startup time")
+
+def import_profile(module: str) -> List[Tuple[str, int, int]]:
+    """Import a module in a fresh interpreter; returns (name, self_us, cumulative_us) per module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def time_to_first_request(path: str, timeout: float) -> float:
+    """Seconds from spawning uvicorn until path first answers 200"""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}{path}"
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR
+    )
+    try:
+        while time.perf_counter() - started_at < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started_at
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"{url} did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+@app.command()
+def main(
+    module: str = typer.Option("server", help="Module whose import is profiled"),
+    top: int = typer.Option(15, help="Number of slowest modules to list"),
+    path: str = typer.Option("/api/health/live", help="Endpoint polled for the first request, e.g. /api/health/ready"),
+    timeout: float = typer.Option(60.0, help="Seconds to wait for the first request"),
+    skip_server: bool = typer.Option(False, help="Only profile imports"),
+    max_import_ms: Optional[float] = typer.Option(None, help="Fail if importing the module takes longer"),
+    max_first_request_ms: Optional[float] = typer.Option(None, help="Fail if the first request takes longer"),
+    as_json: bool = typer.Option(False, "--json", help="Print results as JSON")
+):
+    """Report import time per module and time to first request"""
+    rows = import_profile(module)
+    total_us = next((cumulative for name, _, cumulative in rows if name == module), 0)
+    slowest = sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+
+    first_request_ms = None
+    if not skip_server:
+        first_request_ms = time_to_first_request(path, timeout) * 1000
+
+    if as_json:
+        typer.echo(json.dumps({
+            "import_ms": total_us / 1000,
+            "first_request_ms": first_request_ms,
+            "slowest_imports": [
+                {"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+                for name, self_us, cumulative_us in slowest
+            ]
+        }, indent=2))
+    else:
+        typer.echo(f"import {module}: {total_us / 1000:.1f} ms")
+        typer.echo(f"{'cumulative ms':>14} {'self ms':>10}  module")
+        for name, self_us, cumulative_us in slowest:
+            typer.echo(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>10.1f}  {name}")
+        if first_request_ms is not None:
+            typer.echo(f"first request to {path}: {first_request_ms:.1f} ms")
+
+    failed = False
+    if max_import_ms is not None and total_us / 1000 > max_import_ms:
+        typer.echo(f"Import time {total_us / 1000:.1f} ms exceeds {max_import_ms} ms", err=True)
+        failed = True
+    if max_first_request_ms is not None and first_request_ms is not None and first_request_ms > max_first_request_ms:
+        typer.echo(f"First request {first_request_ms:.1f} ms exceeds {max_first_request_ms} ms", err=True)
+        failed = True
+    if failed:
+        raise typer.Exit(code=1)
+
+if __name__ == "__main__":
+    app()
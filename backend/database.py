@@ -2,20 +2,111 @@
 Database configuration and utilities for Dodo Payments
 """
 import os
-from typing import Dict
+import time
+import asyncio
+import threading
+import logging
+from typing import Dict, Any, List, Tuple
 import motor.motor_asyncio
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING, IndexModel, monitoring
 
-# Global database client
+from services.stats import LatencyStats
+from metrics import MongoCommandMetrics
+from services.lease import Lease
+
+logger = logging.getLogger(__name__)
+
+# Global database client, shared by every collection in this process
 _db_client: AsyncIOMotorClient = None
 _database = None
+_indexes_ready = False
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Tracks connection checkouts and checkout wait time for the shared pool"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.checkout_wait = LatencyStats()
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures: Dict[str, int] = {}
+        self.connections_open = 0
+        self.connections_created = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open -= 1
+
+    def connection_check_out_started(self, event):
+        # Checkout start and completion are reported on the same thread
+        self._local.started_at = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures[event.reason] = self.checkout_failures.get(event.reason, 0) + 1
+            self._observe_wait()
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self._observe_wait()
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def _observe_wait(self):
+        started_at = getattr(self._local, "started_at", None)
+        if started_at is not None:
+            self.checkout_wait.observe(time.perf_counter() - started_at)
+            self._local.started_at = None
+
+_pool_listener = PoolStatsListener()
+_command_listener = MongoCommandMetrics()
+
+def _client_options() -> Dict[str, Any]:
+    """Connection pool settings from the environment"""
+    options = {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+        "event_listeners": [_pool_listener, _command_listener],
+    }
+    compressors = os.getenv("MONGO_COMPRESSORS")
+    if compressors:
+        options["compressors"] = compressors
+    return options
 
 async def get_database_client() -> AsyncIOMotorClient:
-    """Get or create MongoDB client"""
+    """Get or create the shared MongoDB client"""
     global _db_client
     if _db_client is None:
         mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-        _db_client = AsyncIOMotorClient(mongo_url)
+        _db_client = AsyncIOMotorClient(mongo_url, **_client_options())
     return _db_client
 
 async def get_database():
@@ -34,31 +125,174 @@ async def get_database_collections() -> Dict[str, AsyncIOMotorCollection]:
         "payments": db.payments,
         "subscriptions": db.subscriptions,
         "customers": db.customers,
-        "webhook_events": db.webhook_events
+        "webhook_events": db.webhook_events,
+        "idempotency_keys": db.idempotency_keys,
+        "leases": db.leases,
+        "payment_rollups": db.payment_rollups
     }
 
-async def create_indexes():
-    """Create necessary indexes for payment collections"""
+# Every index the application relies on, per collection. Names are derived
+# from the keys exactly as create_index would, so existing indexes match.
+INDEX_MANIFEST: Dict[str, List[IndexModel]] = {
+    "payments": [
+        IndexModel("payment_id", unique=True),
+        IndexModel("user_id"),
+        IndexModel("customer_id"),
+        IndexModel("status"),
+        IndexModel("created_at"),
+        # Keyset pagination indexes on (filter, created_at, _id)
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("customer_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        # Reconciler batches: pending payments least recently checked first
+        IndexModel([("status", ASCENDING), ("reconcile_next_check_at", ASCENDING), ("created_at", ASCENDING)])
+    ],
+    "subscriptions": [
+        IndexModel("subscription_id", unique=True),
+        IndexModel("user_id"),
+        IndexModel("customer_id"),
+        IndexModel("status"),
+        IndexModel("created_at"),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING), ("current_period_end", DESCENDING)]),
+        IndexModel("current_period_end"),
+        IndexModel([("status", ASCENDING), ("current_period_end", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("customer_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+    ],
+    "webhook_events": [
+        IndexModel("event_id", unique=True),
+        IndexModel("type"),
+        IndexModel("created_at"),
+        IndexModel("expires_at", expireAfterSeconds=0),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+        IndexModel([("ordering_key", ASCENDING), ("received_at", ASCENDING)])
+    ],
+    # Revenue rollups are read by day range, optionally per product/currency
+    "payment_rollups": [
+        IndexModel([("day", ASCENDING), ("product_id", ASCENDING), ("currency", ASCENDING)])
+    ],
+    # Idempotency keys expire once their stored response is no longer needed
+    "idempotency_keys": [
+        IndexModel("expires_at", expireAfterSeconds=0)
+    ]
+}
+
+# Index options that make two indexes with the same keys different
+_INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+def _index_signature(spec: Dict[str, Any]) -> Tuple:
+    return (
+        spec["name"],
+        tuple(spec["key"].items()),
+        tuple((option, spec.get(option)) for option in _INDEX_OPTIONS)
+    )
+
+async def missing_indexes(collection: AsyncIOMotorCollection, manifest: List[IndexModel]) -> List[IndexModel]:
+    """Manifest entries with no identical live index on the collection"""
+    live = {_index_signature(spec) async for spec in collection.list_indexes()}
+    return [index for index in manifest if _index_signature(index.document) not in live]
+
+async def _apply_collection_indexes(collection: AsyncIOMotorCollection, manifest: List[IndexModel]) -> int:
+    missing = await missing_indexes(collection, manifest)
+    if missing:
+        # One createIndexes command builds every missing index of the collection
+        await collection.create_indexes(missing)
+        logger.info(f"Created {len(missing)} indexes on {collection.name}")
+    return len(missing)
+
+async def apply_index_manifest() -> int:
+    """Create missing manifest indexes, all collections concurrently; returns the number created
+
+    Raises the first failure after every collection has been attempted.
+    """
     db = await get_database()
+    results = await asyncio.gather(
+        *[_apply_collection_indexes(db[name], manifest) for name, manifest in INDEX_MANIFEST.items()],
+        return_exceptions=True
+    )
+    errors = []
+    for name, result in zip(INDEX_MANIFEST, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Error creating indexes on {name}: {str(result)}")
+            errors.append(result)
+    if errors:
+        raise errors[0]
+    return sum(results)
+
+async def manifest_satisfied() -> bool:
+    """Whether every manifest index already exists"""
+    db = await get_database()
+    missing = await asyncio.gather(
+        *[missing_indexes(db[name], manifest) for name, manifest in INDEX_MANIFEST.items()]
+    )
+    return not any(missing)
+
+async def create_indexes():
+    """Bring the database in line with INDEX_MANIFEST
+
+    INDEX_CREATION_MODE selects who does the work: "all" (every worker applies
+    the manifest, default), "leader" (one worker applies it under a lease while
+    the others wait for it to be satisfied) or "skip" (indexes are managed
+    elsewhere, e.g. `python manage.py ensure-indexes`).
+    """
+    global _indexes_ready
+    mode = os.getenv("INDEX_CREATION_MODE", "all").lower()
     
-    # Payment indexes
-    await db.payments.create_index("payment_id", unique=True)
-    await db.payments.create_index("user_id")
-    await db.payments.create_index("customer_id")
-    await db.payments.create_index("status")
-    await db.payments.create_index("created_at")
-    
-    # Subscription indexes
-    await db.subscriptions.create_index("subscription_id", unique=True)
-    await db.subscriptions.create_index("user_id")
-    await db.subscriptions.create_index("customer_id")
-    await db.subscriptions.create_index("status")
-    await db.subscriptions.create_index("created_at")
+    if mode == "skip":
+        logger.info("Index creation skipped (INDEX_CREATION_MODE=skip)")
+    elif mode == "leader":
+        db = await get_database()
+        lease = Lease(db.leases, "index_builder", ttl_seconds=float(os.getenv("INDEX_LEASE_SECONDS", "300")))
+        if await lease.acquire():
+            try:
+                await apply_index_manifest()
+            finally:
+                await lease.release()
+        else:
+            deadline = time.monotonic() + float(os.getenv("INDEX_WAIT_SECONDS", "120"))
+            while not await manifest_satisfied():
+                if time.monotonic() > deadline:
+                    raise TimeoutError("Timed out waiting for the index leader to create indexes")
+                await asyncio.sleep(1)
+    else:
+        await apply_index_manifest()
     
-    # Webhook events indexes
-    await db.webhook_events.create_index("event_id", unique=True)
-    await db.webhook_events.create_index("type")
-    await db.webhook_events.create_index("created_at")
+    _indexes_ready = True
+
+def indexes_ready() -> bool:
+    """Whether create_indexes has completed in this process"""
+    return _indexes_ready
+
+async def ping_database(timeout: float = 2.0) -> bool:
+    """Round-trip a ping to MongoDB, False if it fails or takes longer than timeout"""
+    try:
+        client = await get_database_client()
+        await asyncio.wait_for(client.admin.command("ping"), timeout)
+        return True
+    except Exception:
+        return False
+
+async def warm_database_pool():
+    """Open connections up front so the first requests don't pay for them"""
+    client = await get_database_client()
+    await client.admin.command("ping")
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Checkout and wait-time statistics for the shared MongoDB pool"""
+    options = _client_options()
+    return {
+        "max_pool_size": options["maxPoolSize"],
+        "min_pool_size": options["minPoolSize"],
+        "connections_open": _pool_listener.connections_open,
+        "connections_created": _pool_listener.connections_created,
+        "checked_out": _pool_listener.checked_out,
+        "checkouts": _pool_listener.checkouts,
+        "checkout_failures": dict(_pool_listener.checkout_failures),
+        "checkout_wait": _pool_listener.checkout_wait.snapshot()
+    }
 
 async def close_database_connection():
     """Close database connection"""
@@ -0,0 +1,103 @@
+"""
+Gunicorn configuration for running the backend with uvicorn workers
+
+Run from the backend directory with `gunicorn -c gunicorn.conf.py server:app`.
+Each worker opens its own MongoDB and Dodo connections in the FastAPI startup
+event.
+
+One worker per CPU runs by default (WEB_CONCURRENCY overrides it). Status
+streams and the payment and entitlement caches live in each process, and only
+STATUS_EVENTS_SOURCE=change_stream (MongoDB replica set required) relays status
+changes and cache invalidations between workers. With several workers and the
+local source, the caches default to off and status streams re-read the database
+every few seconds, so no worker serves a status another worker has changed.
+Setting the TTLs explicitly opts back into stale reads. The Dodo simulator
+keeps its state in memory and always runs a single worker.
+
+Send SIGHUP to the master to replace all workers gracefully. With
+GUNICORN_PRELOAD=true the application is imported once in the master, so new
+workers are forked from the code already loaded; deploying new code then needs
+a full restart.
+"""
+import os
+import shutil
+import tempfile
+import importlib
+
+def _cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+_cross_worker = os.getenv("STATUS_EVENTS_SOURCE", "local").lower() == "change_stream"
+_simulator = (
+    os.getenv("DODO_PAYMENTS_MODE", "test").lower() == "simulator"
+    or (os.getenv("DODO_PAYMENTS_API_URL") or "").startswith("simulator:")
+)
+
+bind = os.getenv("BIND", "0.0.0.0:8001")
+worker_class = "uvicorn.workers.UvicornWorker"
+# Async workers saturate a core each, so one per CPU is enough
+if _simulator:
+    workers = 1
+else:
+    workers = int(os.getenv("WEB_CONCURRENCY", str(_cpu_count())))
+
+# Without cross-worker invalidation, a cached status can be one another worker
+# already changed. Read in the environment the workers inherit.
+_local_cache_ttls = ["PAYMENT_CACHE_TTL_SECONDS", "ENTITLEMENT_CACHE_TTL_SECONDS", "ENTITLEMENT_NEGATIVE_TTL_SECONDS"]
+if workers > 1 and not _cross_worker:
+    for name in _local_cache_ttls:
+        os.environ.setdefault(name, "0")
+    os.environ.setdefault("SSE_KEEPALIVE_SECONDS", "3")
+
+# Importing the app in the master lets workers share its memory pages, but
+# SIGHUP then restarts workers on the old code
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+# Recycle workers after a number of requests, staggered so they don't all restart at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "1000"))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+# Must outlast nginx's upstream keepalive_timeout (60s) so nginx closes idle
+# connections first and never reuses one the worker is about to drop
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+backlog = int(os.getenv("GUNICORN_BACKLOG", "2048"))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+
+# Aggregate Prometheus metrics across workers. The directory has to exist before
+# the app is preloaded, and is emptied once per master (not on every SIGHUP,
+# which re-reads this file) so files from a previous run aren't summed in.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus_multiproc"))
+if os.environ.get("_PROMETHEUS_MULTIPROC_OWNER") != str(os.getpid()):
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    os.environ["_PROMETHEUS_MULTIPROC_OWNER"] = str(os.getpid())
+
+# Let one worker build indexes while the others wait for it
+os.environ.setdefault("INDEX_CREATION_MODE", "leader")
+
+def on_starting(server):
+    if _simulator and int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        server.log.warning("The Dodo simulator keeps its state in memory, ignoring WEB_CONCURRENCY")
+    elif workers > 1 and not _cross_worker and any(float(os.environ[name]) > 0 for name in _local_cache_ttls):
+        server.log.warning(
+            f"Running {workers} workers with STATUS_EVENTS_SOURCE=local and caching enabled: "
+            "caches may serve a status another worker changed until their TTL; "
+            "use STATUS_EVENTS_SOURCE=change_stream"
+        )
+
+def when_ready(server):
+    if preload_app:
+        # Workers otherwise import the Dodo SDK lazily, each on its own
+        importlib.import_module("dodopayments")
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,36 @@
+"""
+Liveness and readiness checks for the backend
+"""
+import os
+from typing import Dict, Any
+
+from database import ping_database, indexes_ready
+from services.cache import TTLCache
+from services.registry import dodo_service_ready
+
+class ReadinessProbe:
+    """Checks MongoDB, index creation and the Dodo client, caching the result briefly
+
+    Probes arriving within the cache window, or while a check is running, share
+    one result so frequent polling never piles pings onto MongoDB.
+    """
+
+    def __init__(self, cache_seconds: float = 1.0, ping_timeout: float = 2.0):
+        self.ping_timeout = ping_timeout
+        self._cache = TTLCache(max_size=1, ttl=cache_seconds)
+
+    async def _run_checks(self) -> Dict[str, Any]:
+        checks = {
+            "mongo": await ping_database(self.ping_timeout),
+            "indexes": indexes_ready(),
+            "dodo_client": dodo_service_ready()
+        }
+        return {"ready": all(checks.values()), "checks": checks}
+
+    async def check(self) -> Dict[str, Any]:
+        return await self._cache.get_or_load("readiness", self._run_checks)
+
+readiness_probe = ReadinessProbe(
+    cache_seconds=float(os.getenv("READINESS_CACHE_SECONDS", "1")),
+    ping_timeout=float(os.getenv("READINESS_PING_TIMEOUT_SECONDS", "2"))
+)
@@ -0,0 +1,211 @@
+"""
+Maintenance commands for the payments backend
+
+Run from the backend directory, e.g. `python manage.py backfill-subscription-periods`.
+"""
+import asyncio
+import logging
+from pathlib import Path
+from typing import Tuple
+from datetime import datetime, timedelta
+import typer
+from dotenv import load_dotenv
+from pymongo import ReplaceOne, UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from database import get_database, close_database_connection, apply_index_manifest
+from models.payment import PaymentStatus
+from services.dodo_payments import subscription_period
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+app = typer.Typer(help="Payments backend maintenance commands")
+
+@app.callback()
+def main():
+    """Payments backend maintenance commands"""
+
+async def _backfill_subscription_periods(batch_size: int, dry_run: bool) -> int:
+    db = await get_database()
+    query = {
+        "current_period_end": None,
+        "$or": [
+            {"metadata.current_period_end": {"$ne": None}},
+            {"metadata.webhook_data": {"$exists": True}}
+        ]
+    }
+    cursor = db.subscriptions.find(query, {"metadata": 1}, batch_size=batch_size)
+
+    updated = 0
+    batch = []
+    async for doc in cursor:
+        metadata = doc.get("metadata") or {}
+        data = dict(metadata.get("webhook_data") or {})
+        if metadata.get("current_period_end"):
+            data.setdefault("current_period_end", metadata["current_period_end"])
+        period = subscription_period(data)
+        if not period:
+            continue
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": period}))
+        if len(batch) >= batch_size:
+            updated += await _flush(db.subscriptions, batch, dry_run)
+            batch = []
+    if batch:
+        updated += await _flush(db.subscriptions, batch, dry_run)
+    return updated
+
+async def _flush(collection, batch, dry_run: bool) -> int:
+    if dry_run:
+        return len(batch)
+    result = await collection.bulk_write(batch, ordered=False)
+    logger.info(f"Backfilled {result.modified_count} subscriptions")
+    return result.modified_count
+
+@app.command("backfill-subscription-periods")
+def backfill_subscription_periods(
+    batch_size: int = typer.Option(500, help="Documents per bulk_write"),
+    dry_run: bool = typer.Option(False, help="Count matching documents without writing")
+):
+    """Copy billing period dates from subscription metadata into indexed fields"""
+    async def run():
+        try:
+            return await _backfill_subscription_periods(batch_size, dry_run)
+        finally:
+            await close_database_connection()
+
+    updated = asyncio.run(run())
+    typer.echo(f"{'Would update' if dry_run else 'Updated'} {updated} subscriptions")
+
+# Live webhooks only ever add to the current day's rollups; days that ended
+# longer ago than this are settled and safe to rebuild
+ROLLUP_SETTLE_SECONDS = 300
+
+ROLLUP_OUTCOMES = [PaymentStatus.SUCCESS.value, PaymentStatus.FAILED.value, PaymentStatus.REFUNDED.value]
+
+# Outcomes a payment must have reached to be in each status, for payments
+# settled before outcome_at was recorded
+_IMPLIED_OUTCOMES = {
+    PaymentStatus.SUCCESS.value: [PaymentStatus.SUCCESS.value],
+    PaymentStatus.REFUNDED.value: [PaymentStatus.SUCCESS.value, PaymentStatus.REFUNDED.value],
+    PaymentStatus.DISPUTED.value: [PaymentStatus.SUCCESS.value],
+    PaymentStatus.FAILED.value: [PaymentStatus.FAILED.value]
+}
+
+async def _backfill_outcome_times(db, before: datetime, batch_size: int) -> int:
+    """Date outcomes that predate outcome_at by the payment's last update"""
+    query = {
+        "updated_at": {"$lt": before},
+        "$or": [{"rolled_up": {"$exists": True}}, {"status": {"$in": list(_IMPLIED_OUTCOMES)}}]
+    }
+    projection = {"status": 1, "rolled_up": 1, "outcome_at": 1, "updated_at": 1}
+    cursor = db.payments.find(query, projection, batch_size=batch_size)
+
+    updated = 0
+    batch = []
+    async for doc in cursor:
+        outcomes = set(doc.get("rolled_up") or [])
+        outcomes.update(_IMPLIED_OUTCOMES.get(doc.get("status"), []))
+        for outcome in outcomes - set(doc.get("outcome_at") or {}):
+            # Conditional, so an outcome the live path records meanwhile is kept
+            batch.append(UpdateOne(
+                {"_id": doc["_id"], f"outcome_at.{outcome}": {"$exists": False}},
+                {"$set": {f"outcome_at.{outcome}": doc["updated_at"]}, "$addToSet": {"rolled_up": outcome}}
+            ))
+        if len(batch) >= batch_size:
+            updated += (await db.payments.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await db.payments.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+async def _rebuild_payment_rollups(batch_size: int) -> Tuple[str, int]:
+    """Recompute settled days from outcome_at; returns the first day left to the live path"""
+    db = await get_database()
+    cutoff_day = (datetime.utcnow() - timedelta(seconds=ROLLUP_SETTLE_SECONDS)).strftime("%Y-%m-%d")
+    cutoff = datetime.strptime(cutoff_day, "%Y-%m-%d")
+
+    backfilled = await _backfill_outcome_times(db, cutoff, batch_size)
+    if backfilled:
+        logger.info(f"Dated {backfilled} payment outcomes from updated_at")
+
+    # Same definition as record_payment_outcome: every outcome a payment
+    # reached, counted on the day it was reached
+    counters = {}
+    for outcome in ROLLUP_OUTCOMES:
+        reached = {"$eq": ["$outcome.k", outcome]}
+        counters[f"{outcome}_count"] = {"$sum": {"$cond": [reached, 1, 0]}}
+        counters[f"{outcome}_amount"] = {"$sum": {"$cond": [reached, "$amount", 0]}}
+    pipeline = [
+        {"$match": {"outcome_at": {"$exists": True}}},
+        {"$project": {
+            "product_id": 1,
+            "currency": 1,
+            "amount": 1,
+            "outcome": {"$objectToArray": "$outcome_at"}
+        }},
+        {"$unwind": "$outcome"},
+        {"$match": {"outcome.k": {"$in": ROLLUP_OUTCOMES}, "outcome.v": {"$lt": cutoff}}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$outcome.v"}},
+                "product_id": "$product_id",
+                "currency": "$currency"
+            },
+            **counters
+        }}
+    ]
+
+    # Rows are replaced in place, so the live collection and its indexes stay
+    # untouched for today, which webhooks keep incrementing meanwhile
+    rebuilt = set()
+    batch = []
+    cursor = db.payments.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+    async for row in cursor:
+        key = row.pop("_id")
+        doc_id = f"{key['day']}:{key.get('product_id')}:{key.get('currency')}"
+        batch.append(ReplaceOne({"_id": doc_id}, {**key, **row}, upsert=True))
+        rebuilt.add(doc_id)
+        if len(batch) >= batch_size:
+            await db.payment_rollups.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.payment_rollups.bulk_write(batch, ordered=False)
+
+    # Drop settled rows with no payments left behind them
+    await db.payment_rollups.delete_many({"day": {"$lt": cutoff_day}, "_id": {"$nin": list(rebuilt)}})
+    return cutoff_day, len(rebuilt)
+
+@app.command("rebuild-payment-rollups")
+def rebuild_payment_rollups(
+    batch_size: int = typer.Option(1000, help="Aggregation batch size and documents per bulk_write")
+):
+    """Recompute payment_rollups for settled days from the payments collection"""
+    async def run():
+        try:
+            return await _rebuild_payment_rollups(batch_size)
+        finally:
+            await close_database_connection()
+
+    cutoff_day, written = asyncio.run(run())
+    typer.echo(f"Rebuilt payment rollups before {cutoff_day} ({written} rows)")
+
+@app.command("ensure-indexes")
+def ensure_indexes():
+    """Create any indexes from the manifest that are missing"""
+    async def run():
+        try:
+            return await apply_index_manifest()
+        finally:
+            await close_database_connection()
+
+    created = asyncio.run(run())
+    typer.echo(f"Created {created} missing indexes")
+
+if __name__ == "__main__":
+    app()
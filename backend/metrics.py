@@ -0,0 +1,162 @@
+"""
+Prometheus metrics for routes, MongoDB operations and Dodo API calls
+
+Set PROMETHEUS_MULTIPROC_DIR to an empty, writable directory before starting
+the server to aggregate metrics across multiple worker processes.
+"""
+import os
+import time
+import threading
+from typing import Dict, Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    generate_latest, multiprocess
+)
+from pymongo import monitoring
+from starlette.requests import Request
+from starlette.responses import Response
+
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests by route",
+    ["method", "route", "status"]
+)
+HTTP_REQUEST_ERRORS = Counter(
+    "http_request_errors_total",
+    "HTTP requests that failed with a 5xx status or an unhandled exception",
+    ["method", "route"]
+)
+MONGO_OPERATION_LATENCY = Histogram(
+    "mongo_operation_duration_seconds",
+    "Latency of MongoDB commands",
+    ["command", "collection"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+MONGO_OPERATION_ERRORS = Counter(
+    "mongo_operation_errors_total",
+    "MongoDB commands that failed",
+    ["command", "collection"]
+)
+DODO_API_LATENCY = Histogram(
+    "dodo_api_call_duration_seconds",
+    "Latency of outbound Dodo Payments API calls",
+    ["operation"]
+)
+DODO_API_ERRORS = Counter(
+    "dodo_api_call_errors_total",
+    "Outbound Dodo Payments API calls that raised",
+    ["operation", "error"]
+)
+WEBHOOK_EVENTS = Counter(
+    "webhook_events_total",
+    "Verified webhook events received, by event type",
+    ["event_type"]
+)
+WEBHOOK_VERIFICATION_FAILURES = Counter(
+    "webhook_verification_failures_total",
+    "Webhook requests rejected before processing",
+    ["reason"]
+)
+WEBHOOK_HANDLER_LATENCY = Histogram(
+    "webhook_handler_duration_seconds",
+    "Latency of individual webhook event handlers",
+    ["event_type", "handler"]
+)
+WEBHOOK_HANDLER_ERRORS = Counter(
+    "webhook_handler_errors_total",
+    "Webhook event handlers that raised",
+    ["event_type", "handler"]
+)
+PAYMENT_ROLLUP_MISSES = Counter(
+    "payment_rollup_misses_total",
+    "Payment outcomes left out of the rollups because the payment is not in the database",
+    ["outcome"]
+)
+RECONCILER_CHECKED = Counter(
+    "reconciler_payments_checked_total",
+    "Stale pending payments checked against the Dodo API"
+)
+RECONCILER_CORRECTED = Counter(
+    "reconciler_payments_corrected_total",
+    "Pending payments whose status was corrected by the reconciler"
+)
+RECONCILER_ERRORS = Counter(
+    "reconciler_errors_total",
+    "Errors raised while reconciling pending payments"
+)
+RECONCILER_LAG = Gauge(
+    "reconciler_oldest_pending_age_seconds",
+    "Age of the oldest stale pending payment seen in the last run",
+    multiprocess_mode="max"
+)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records latency and failures of every command issued on the shared client"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[int, int], str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._pending[(event.request_id, event.operation_id)] = (
+                collection if isinstance(collection, str) else ""
+            )
+
+    def _pop(self, event) -> str:
+        with self._lock:
+            return self._pending.pop((event.request_id, event.operation_id), "")
+
+    def succeeded(self, event):
+        MONGO_OPERATION_LATENCY.labels(event.command_name, self._pop(event)).observe(
+            event.duration_micros / 1_000_000
+        )
+
+    def failed(self, event):
+        collection = self._pop(event)
+        MONGO_OPERATION_LATENCY.labels(event.command_name, collection).observe(
+            event.duration_micros / 1_000_000
+        )
+        MONGO_OPERATION_ERRORS.labels(event.command_name, collection).inc()
+
+class PrometheusMiddleware:
+    """ASGI middleware that records latency and errors per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started_at = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The matched route is only known after routing, use its template as the label
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_LATENCY.labels(scope["method"], route_path, str(status_code)).observe(
+                time.perf_counter() - started_at
+            )
+            if status_code >= 500:
+                HTTP_REQUEST_ERRORS.labels(scope["method"], route_path).inc()
+
+def metrics_response(request: Request) -> Response:
+    """Render all metrics, aggregated across workers in multiprocess mode"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
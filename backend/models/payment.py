@@ -11,12 +11,16 @@ class PaymentStatus(str, Enum):
     SUCCESS = "success"
     FAILED = "failed"
     CANCELED = "canceled"
+    REFUNDED = "refunded"
+    DISPUTED = "disputed"
 
 class SubscriptionStatus(str, Enum):
+    PENDING = "pending"
     ACTIVE = "active"
     ON_HOLD = "on_hold"
     FAILED = "failed"
     CANCELED = "canceled"
+    EXPIRED = "expired"
 
 class BillingAddress(BaseModel):
     street: str
@@ -51,9 +55,21 @@ class PaymentResponse(BaseModel):
     status: str
     expires_at: Optional[str] = None
 
+class BatchCreatePaymentRequest(BaseModel):
+    payments: List[CreatePaymentRequest] = Field(..., min_length=1, max_length=500)
+
+class BatchPaymentResult(BaseModel):
+    index: int
+    payment: Optional[PaymentResponse] = None
+    error: Optional[str] = None
+
+class BatchPaymentResponse(BaseModel):
+    results: List[BatchPaymentResult]
+
 class CreateSubscriptionRequest(BaseModel):
     customer: PaymentCustomer
     product_id: str
+    quantity: int = 1
     billing: BillingAddress
     payment_link: bool = True
     subscription_id: Optional[str] = None
@@ -66,6 +82,28 @@ class SubscriptionResponse(BaseModel):
     product_id: str
     payment_url: Optional[str] = None
 
+class PaginatedRecords(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+
+class EntitlementResponse(BaseModel):
+    user_id: str
+    active: bool
+    subscription_id: Optional[str] = None
+    current_period_end: Optional[datetime] = None
+
+class PaymentRollup(BaseModel):
+    day: str
+    product_id: Optional[str] = None
+    currency: str
+    success_count: int = 0
+    success_amount: int = 0
+    failed_count: int = 0
+    failed_amount: int = 0
+    # Full refunds and lost disputes, on the day they happened; success totals stay gross
+    refunded_count: int = 0
+    refunded_amount: int = 0
+
 class WebhookEvent(BaseModel):
     business_id: str
     timestamp: str
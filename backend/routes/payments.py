@@ -1,39 +1,73 @@
 """
 Payment API routes for Dodo Payments integration
 """
+import os
 import logging
-import hmac
-import hashlib
+import asyncio
 import json
-import sys
-from pathlib import Path
-from typing import Dict, Any
-from fastapi import APIRouter, HTTPException, Request, Depends, status
-from fastapi.responses import JSONResponse
-
-# Add the current directory to the Python path
-sys.path.append(str(Path(__file__).parent.parent))
+import uuid
+from typing import Dict, Any, List, Optional, Callable, Awaitable, AsyncIterator
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Request, Depends, Query, Header, status
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from models.payment import (
     CreatePaymentRequest, PaymentResponse, CreateSubscriptionRequest,
-    SubscriptionResponse, WebhookEvent, PaymentStatus, SubscriptionStatus
+    SubscriptionResponse, WebhookEvent, PaymentStatus, SubscriptionStatus,
+    PaginatedRecords, BatchCreatePaymentRequest, BatchPaymentResponse,
+    EntitlementResponse, PaymentRollup
+)
+from services.dodo_payments import DodoPaymentsService, subscription_period
+from services.export import EXPORT_FORMATS
+from services.idempotency import IdempotencyError, request_fingerprint
+from services.admission import AdmissionRejected
+from services.webhooks import WebhookVerificationError, load_json, read_limited_body
+from services.webhook_dispatcher import WebhookDispatcher
+from database import get_pool_stats
+from metrics import WEBHOOK_EVENTS, WEBHOOK_VERIFICATION_FAILURES
+from services.registry import (
+    get_dodo_service, get_client_pool_stats, get_webhook_worker_pool,
+    get_payment_reconciler, get_simulator_stats
 )
-from services.dodo_payments import DodoPaymentsService
-from database import get_database_collections
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/payments", tags=["payments"])
 
-async def get_dodo_service() -> DodoPaymentsService:
-    """Dependency to get Dodo Payments service"""
-    collections = await get_database_collections()
-    return DodoPaymentsService(collections)
+@router.get("/stats")
+async def get_service_stats(
+    dodo_service: DodoPaymentsService = Depends(get_dodo_service)
+):
+    """Runtime statistics for the shared payment services"""
+    webhook_pool = get_webhook_worker_pool()
+    reconciler = get_payment_reconciler()
+    return {
+        "mongo_pool": get_pool_stats(),
+        "dodo_client": get_client_pool_stats(),
+        "dodo_api": dodo_service.get_api_stats(),
+        "status_batches": dodo_service.get_batch_stats(),
+        "caches": dodo_service.get_cache_stats(),
+        "status_streams": dodo_service.status_broker.get_stats(),
+        "webhook_workers": await webhook_pool.get_stats() if webhook_pool else None,
+        "webhook_handlers": webhook_dispatcher.get_stats(),
+        "reconciler": reconciler.get_stats() if reconciler else None,
+        "simulator": get_simulator_stats()
+    }
+
+def overloaded(error: AdmissionRejected) -> HTTPException:
+    """503 telling the client when to retry a shed request"""
+    logger.warning(f"Shedding request: {str(error)}")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Payment provider is busy, please retry later",
+        headers={"Retry-After": str(error.retry_after)}
+    )
 
 @router.post("/checkout", response_model=PaymentResponse)
 async def create_payment_checkout(
     payment_request: CreatePaymentRequest,
     request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     dodo_service: DodoPaymentsService = Depends(get_dodo_service)
 ):
     """Create a checkout session for one-time payment"""
@@ -41,9 +75,23 @@ async def create_payment_checkout(
         # You can extract user_id from auth token here if needed
         user_id = getattr(request.state, 'user_id', None)
         
+        if idempotency_key and dodo_service.idempotency is not None:
+            return await dodo_service.idempotency.run(
+                "checkout",
+                idempotency_key,
+                request_fingerprint(payment_request),
+                PaymentResponse,
+                lambda: dodo_service.create_payment(payment_request, user_id),
+                should_store=lambda response: not dodo_service.is_mock_response(response)
+            )
+        
         payment_response = await dodo_service.create_payment(payment_request, user_id)
         return payment_response
         
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except AdmissionRejected as e:
+        raise overloaded(e)
     except Exception as e:
         logger.error(f"Error creating payment checkout: {str(e)}")
         raise HTTPException(
@@ -51,10 +99,31 @@ async def create_payment_checkout(
             detail=f"Failed to create payment checkout: {str(e)}"
         )
 
+@router.post("/checkout/batch", response_model=BatchPaymentResponse)
+async def create_payment_checkout_batch(
+    batch_request: BatchCreatePaymentRequest,
+    request: Request,
+    dodo_service: DodoPaymentsService = Depends(get_dodo_service)
+):
+    """Create many checkout sessions at once; results are returned per item in order"""
+    try:
+        user_id = getattr(request.state, 'user_id', None)
+        
+        results = await dodo_service.create_payments_batch(batch_request.payments, user_id)
+        return BatchPaymentResponse(results=results)
+        
+    except Exception as e:
+        logger.error(f"Error creating payment checkout batch: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to create payment checkout batch: {str(e)}"
+        )
+
 @router.post("/subscriptions", response_model=SubscriptionResponse)
 async def create_subscription(
     subscription_request: CreateSubscriptionRequest,
     request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     dodo_service: DodoPaymentsService = Depends(get_dodo_service)
 ):
     """Create a subscription"""
@@ -62,9 +131,23 @@ async def create_subscription(
         # You can extract user_id from auth token here if needed
         user_id = getattr(request.state, 'user_id', None)
         
+        if idempotency_key and dodo_service.idempotency is not None:
+            return await dodo_service.idempotency.run(
+                "subscriptions",
+                idempotency_key,
+                request_fingerprint(subscription_request),
+                SubscriptionResponse,
+                lambda: dodo_service.create_subscription(subscription_request, user_id),
+                should_store=lambda response: not dodo_service.is_mock_response(response)
+            )
+        
         subscription_response = await dodo_service.create_subscription(subscription_request, user_id)
         return subscription_response
         
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except AdmissionRejected as e:
+        raise overloaded(e)
     except Exception as e:
         logger.error(f"Error creating subscription: {str(e)}")
         raise HTTPException(
@@ -72,6 +155,213 @@ async def create_subscription(
             detail=f"Failed to create subscription: {str(e)}"
         )
 
+@router.get("/payments", response_model=PaginatedRecords)
+async def list_payments(
+    user_id: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    payment_status: Optional[PaymentStatus] = Query(None, alias="status"),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    fields: Optional[str] = None,
+    include_metadata: bool = False,
+    dodo_service: DodoPaymentsService = Depends(get_dodo_service)
+):
+    """List payments newest first; pass next_cursor back as cursor for the next page"""
+    try:
+        return await dodo_service.list_payments(
+            user_id=user_id,
+            customer_id=customer_id,
+            status=payment_status,
+            created_after=created_after,
+            created_before=created_before,
+            cursor=cursor,
+            limit=limit,
+            fields=fields,
+            include_metadata=include_metadata
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error listing payments: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to list payments: {str(e)}"
+        )
+
+@router.get("/subscriptions", response_model=PaginatedRecords)
+async def list_subscriptions(
+    user_id: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    subscription_status: Optional[SubscriptionStatus] = Query(None, alias="status"),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    fields: Optional[str] = None,
+    include_metadata: bool = False,
+    dodo_service: DodoPaymentsService = Depends(get_dodo_service)
+):
+    """List subscriptions newest first; pass next_cursor back as cursor for the next page"""
+    try:
+        return await dodo_service.list_subscriptions(
+            user_id=user_id,
+            customer_id=customer_id,
+            status=subscription_status,
+            created_after=created_after,
+            created_before=created_before,
+            cursor=cursor,
+            limit=limit,
+            fields=fields,
+            include_metadata=include_metadata
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error listing subscriptions: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to list subscriptions: {str(e)}"
+        )
+
+@router.get("/payments/export")
+async def export_payments(
+    export_format: str = Query("ndjson", alias="format"),
+    payment_status: Optional[PaymentStatus] = Query(None, alias="status"),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    include_metadata: bool = False,
+    gzip: bool = False,
+    dodo_service: DodoPaymentsService = Depends(get_dodo_service)
+):
+    """Stream payment history as NDJSON or CSV, optionally gzip-compressed"""
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported export format: {export_format}"
+        )
+    if dodo_service.payments_collection is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Payments collection is not available"
+        )
+    
+    chunks = dodo_service.export_payments(
+        export_format=export_format,
+        status=payment_status,
+        created_after=created_after,
+        created_before=created_before,
+        include_metadata=include_metadata,
+        compress=gzip
+    )
+    filename = f"payments.{export_format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip" if gzip else EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+TERMINAL_PAYMENT_STATUSES = {PaymentStatus.SUCCESS, PaymentStatus.FAILED, PaymentStatus.CANCELED}
+
+def _sse_message(event: str, data: Dict[str, Any]) -> bytes:
+    payload = json.dumps(data, default=lambda value: value.isoformat() if hasattr(value, "isoformat") else str(value))
+    return f"event: {event}\ndata: {payload}\n\n".encode()
+
+async def _status_event_stream(
+    request: Request,
+    dodo_service: DodoPaymentsService,
+    topic: tuple,
+    load_current: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+    terminal_statuses: set
+) -> AsyncIterator[bytes]:
+    """Yield the current status, then every change, until a terminal status or disconnect"""
+    keepalive = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+    max_duration = float(os.getenv("SSE_MAX_STREAM_SECONDS", "300"))
+    loop = asyncio.get_running_loop()
+    
+    # Subscribe before reading the current state so no update can slip in between
+    with dodo_service.status_broker.subscribe(topic) as queue:
+        last_status = None
+        current = await load_current()
+        if current is not None:
+            yield _sse_message("status", current)
+            if current["status"] in terminal_statuses:
+                return
+            last_status = current["status"]
+        
+        deadline = loop.time() + max_duration
+        while loop.time() < deadline:
+            if await request.is_disconnected():
+                return
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                # Re-read on each keepalive so changes published by other workers still arrive
+                message = await load_current()
+                if message is None or message["status"] == last_status:
+                    yield b": keepalive\n\n"
+                    continue
+            yield _sse_message("status", message)
+            if message["status"] in terminal_statuses:
+                return
+            last_status = message["status"]
+
+def _event_stream_response(stream: AsyncIterator[bytes]) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Tell nginx not to buffer the stream
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@router.get("/payments/{payment_id}/events")
+async def stream_payment_status(
+    payment_id: str,
+    request: Request,
+    dodo_service: DodoPaymentsService = Depends(get_dodo_service)
+):
+    """Server-sent events stream of a payment's status changes"""
+    if await dodo_service.get_payment(payment_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Payment not found"
+        )
+    
+    # Read past the payment cache, which may still hold a status that has since changed
+    async def load_current():
+        return await dodo_service.get_current_status("payment", payment_id)
+    
+    return _event_stream_response(_status_event_stream(
+        request, dodo_service, ("payment", payment_id), load_current, TERMINAL_PAYMENT_STATUSES
+    ))
+
+@router.get("/subscriptions/{subscription_id}/events")
+async def stream_subscription_status(
+    subscription_id: str,
+    request: Request,
+    dodo_service: DodoPaymentsService = Depends(get_dodo_service)
+):
+    """Server-sent events stream of a subscription's status changes"""
+    if await dodo_service.get_subscription(subscription_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Subscription not found"
+        )
+    
+    async def load_current():
+        return await dodo_service.get_current_status("subscription", subscription_id)
+    
+    # Subscriptions have no terminal state; the stream ends on disconnect or timeout
+    return _event_stream_response(_status_event_stream(
+        request, dodo_service, ("subscription", subscription_id), load_current, set()
+    ))
+
 @router.get("/payments/{payment_id}")
 async def get_payment(
     payment_id: str,
@@ -96,6 +386,41 @@ async def get_payment(
             detail=f"Failed to get payment: {str(e)}"
         )
 
+@router.get("/rollups", response_model=List[PaymentRollup])
+async def get_payment_rollups(
+    start_day: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    end_day: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    product_id: Optional[str] = None,
+    currency: Optional[str] = None,
+    dodo_service: DodoPaymentsService = Depends(get_dodo_service)
+):
+    """Revenue and counts per product, currency and day (YYYY-MM-DD, inclusive range)"""
+    try:
+        return await dodo_service.get_payment_rollups(start_day, end_day, product_id, currency)
+        
+    except Exception as e:
+        logger.error(f"Error getting payment rollups: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get payment rollups: {str(e)}"
+        )
+
+@router.get("/entitlements/{user_id}", response_model=EntitlementResponse)
+async def get_entitlement(
+    user_id: str,
+    dodo_service: DodoPaymentsService = Depends(get_dodo_service)
+):
+    """Check whether a user has an active subscription right now"""
+    try:
+        return await dodo_service.get_entitlement(user_id)
+        
+    except Exception as e:
+        logger.error(f"Error getting entitlement: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get entitlement: {str(e)}"
+        )
+
 @router.post("/webhooks/dodo")
 async def handle_dodo_webhook(
     request: Request,
@@ -103,35 +428,66 @@ async def handle_dodo_webhook(
 ):
     """Handle Dodo Payments webhook events"""
     try:
-        # Get raw body for signature verification
-        body = await request.body()
-        
         # Get webhook headers
         webhook_signature = request.headers.get("webhook-signature")
         webhook_id = request.headers.get("webhook-id")
         webhook_timestamp = request.headers.get("webhook-timestamp")
         
         if not webhook_signature or not webhook_id or not webhook_timestamp:
+            WEBHOOK_VERIFICATION_FAILURES.labels("missing_headers").inc()
             logger.error("Missing webhook signature headers")
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Missing webhook signature headers"
             )
         
-        # Verify webhook signature
-        if not verify_webhook_signature(body, webhook_signature, webhook_id, webhook_timestamp, dodo_service.webhook_secret):
-            logger.error("Invalid webhook signature")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid webhook signature"
-            )
+        # Reject replays and oversized bodies before reading or parsing anything
+        verifier = dodo_service.webhook_verifier
+        try:
+            verifier.check_timestamp(webhook_timestamp)
+            body = await read_limited_body(request, dodo_service.webhook_max_body_bytes)
+            verifier.verify(body, webhook_signature, webhook_id, webhook_timestamp)
+        except WebhookVerificationError as e:
+            WEBHOOK_VERIFICATION_FAILURES.labels(e.reason).inc()
+            logger.error(f"Rejected webhook {webhook_id}: {e.detail}")
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
         
-        # Parse webhook event
-        event_data = json.loads(body.decode())
-        event = WebhookEvent(**event_data)
+        # Parse webhook event once, straight from the raw bytes
+        event_data = load_json(body)
+        event = WebhookEvent.model_validate(event_data)
+        WEBHOOK_EVENTS.labels(event.type).inc()
+        
+        # Acknowledge-first mode: store in the inbox and let the workers process it
+        webhook_pool = get_webhook_worker_pool()
+        if webhook_pool is not None:
+            if not await webhook_pool.submit(webhook_id, event_data):
+                logger.info(f"Duplicate webhook {webhook_id} ignored")
+                return JSONResponse(content={"status": "duplicate"}, status_code=200)
+            return JSONResponse(content={"status": "accepted"}, status_code=200)
+        
+        # Claim the delivery first so retries of the same webhook-id are skipped
+        claim = uuid.uuid4().hex
+        existing_status = await dodo_service.record_webhook_event(webhook_id, event.type, claim)
+        if existing_status == "processed":
+            logger.info(f"Duplicate webhook {webhook_id} ignored")
+            return JSONResponse(content={"status": "duplicate"}, status_code=200)
+        if existing_status is not None:
+            # Not acknowledged, so the sender retries in case the running attempt fails
+            logger.info(f"Webhook {webhook_id} is already being processed")
+            return JSONResponse(
+                content={"status": "processing"},
+                status_code=status.HTTP_409_CONFLICT,
+                headers={"Retry-After": str(int(dodo_service.webhook_processing_lease.total_seconds()))}
+            )
         
         # Process webhook event
-        await process_webhook_event(event, dodo_service)
+        try:
+            await process_webhook_event(event, dodo_service)
+        except Exception:
+            await dodo_service.release_webhook_event(webhook_id, claim)
+            raise
+        
+        await dodo_service.mark_webhook_event_processed(webhook_id)
         
         return JSONResponse(content={"status": "success"}, status_code=200)
         
@@ -144,58 +500,19 @@ async def handle_dodo_webhook(
             detail=f"Failed to process webhook: {str(e)}"
         )
 
-def verify_webhook_signature(
-    body: bytes, 
-    signature: str, 
-    webhook_id: str, 
-    timestamp: str, 
-    secret: str
-) -> bool:
-    """Verify Dodo Payments webhook signature"""
-    try:
-        # Create string to sign
-        string_to_sign = f"{webhook_id}.{timestamp}.{body.decode()}"
-        
-        # Compute HMAC with SHA256
-        computed_signature = hmac.new(
-            secret.encode(),
-            string_to_sign.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        # Compare signatures using constant-time comparison
-        return hmac.compare_digest(signature, computed_signature)
-        
-    except Exception as e:
-        logger.error(f"Error verifying webhook signature: {str(e)}")
-        return False
+webhook_dispatcher = WebhookDispatcher()
 
 async def process_webhook_event(event: WebhookEvent, dodo_service: DodoPaymentsService):
     """Process different types of webhook events"""
     try:
         logger.info(f"Processing webhook event: {event.type}")
-        
-        if event.type == "payment.succeeded":
-            await handle_payment_succeeded(event.data, dodo_service)
-        elif event.type == "payment.failed":
-            await handle_payment_failed(event.data, dodo_service)
-        elif event.type == "subscription.active":
-            await handle_subscription_active(event.data, dodo_service)
-        elif event.type == "subscription.on_hold":
-            await handle_subscription_on_hold(event.data, dodo_service)
-        elif event.type == "subscription.failed":
-            await handle_subscription_failed(event.data, dodo_service)
-        elif event.type == "subscription.renewed":
-            await handle_subscription_renewed(event.data, dodo_service)
-        elif event.type == "subscription.plan_changed":
-            await handle_subscription_plan_changed(event.data, dodo_service)
-        else:
-            logger.warning(f"Unhandled webhook event type: {event.type}")
+        await webhook_dispatcher.dispatch(event, dodo_service)
         
     except Exception as e:
         logger.error(f"Error processing webhook event {event.type}: {str(e)}")
         raise
 
+@webhook_dispatcher.on("payment.succeeded")
 async def handle_payment_succeeded(data: Dict[str, Any], dodo_service: DodoPaymentsService):
     """Handle successful payment"""
     payment_id = data.get("payment_id")
@@ -207,6 +524,7 @@ async def handle_payment_succeeded(data: Dict[str, Any], dodo_service: DodoPayme
         )
         logger.info(f"Payment {payment_id} marked as successful")
 
+@webhook_dispatcher.on("payment.failed")
 async def handle_payment_failed(data: Dict[str, Any], dodo_service: DodoPaymentsService):
     """Handle failed payment"""
     payment_id = data.get("payment_id")
@@ -218,6 +536,79 @@ async def handle_payment_failed(data: Dict[str, Any], dodo_service: DodoPayments
         )
         logger.info(f"Payment {payment_id} marked as failed")
 
+def payment_rollup_handler(outcome: PaymentStatus):
+    """Handler adding a settled payment to the revenue rollups, alongside its status update"""
+    async def record_payment_rollup(data: Dict[str, Any], dodo_service: DodoPaymentsService):
+        payment_id = data.get("payment_id")
+        if payment_id:
+            await dodo_service.record_payment_outcome(payment_id, outcome)
+    return record_payment_rollup
+
+webhook_dispatcher.register("payment.succeeded", payment_rollup_handler(PaymentStatus.SUCCESS))
+webhook_dispatcher.register("payment.failed", payment_rollup_handler(PaymentStatus.FAILED))
+
+@webhook_dispatcher.on("refund.succeeded")
+async def handle_refund_succeeded(data: Dict[str, Any], dodo_service: DodoPaymentsService):
+    """Handle a completed refund"""
+    payment_id = data.get("payment_id")
+    if not payment_id:
+        return
+    if data.get("is_partial"):
+        # A partial refund leaves the payment settled
+        logger.info(f"Partial refund {data.get('refund_id')} on payment {payment_id}")
+        return
+    await dodo_service.update_payment_status(
+        payment_id,
+        PaymentStatus.REFUNDED,
+        {"webhook_data": data, "refund_id": data.get("refund_id")}
+    )
+    await dodo_service.record_payment_outcome(payment_id, PaymentStatus.REFUNDED)
+    logger.info(f"Payment {payment_id} refunded")
+
+@webhook_dispatcher.on("refund.failed")
+async def handle_refund_failed(data: Dict[str, Any], dodo_service: DodoPaymentsService):
+    """Handle a failed refund"""
+    logger.warning(f"Refund {data.get('refund_id')} on payment {data.get('payment_id')} failed")
+
+@webhook_dispatcher.on("dispute.opened", "dispute.challenged")
+async def handle_dispute_opened(data: Dict[str, Any], dodo_service: DodoPaymentsService):
+    """Handle a dispute being opened against a payment"""
+    payment_id = data.get("payment_id")
+    if payment_id:
+        await dodo_service.update_payment_status(
+            payment_id,
+            PaymentStatus.DISPUTED,
+            {"webhook_data": data, "dispute_id": data.get("dispute_id")}
+        )
+        logger.info(f"Payment {payment_id} disputed")
+
+@webhook_dispatcher.on("dispute.won", "dispute.cancelled", "dispute.expired")
+async def handle_dispute_won(data: Dict[str, Any], dodo_service: DodoPaymentsService):
+    """Handle a dispute closing in the merchant's favour"""
+    payment_id = data.get("payment_id")
+    if payment_id:
+        await dodo_service.update_payment_status(
+            payment_id,
+            PaymentStatus.SUCCESS,
+            {"webhook_data": data, "dispute_id": data.get("dispute_id")}
+        )
+        logger.info(f"Dispute on payment {payment_id} closed in our favour")
+
+@webhook_dispatcher.on("dispute.lost", "dispute.accepted")
+async def handle_dispute_lost(data: Dict[str, Any], dodo_service: DodoPaymentsService):
+    """Handle a dispute that returned the funds to the customer"""
+    payment_id = data.get("payment_id")
+    if payment_id:
+        await dodo_service.update_payment_status(
+            payment_id,
+            PaymentStatus.REFUNDED,
+            {"webhook_data": data, "dispute_id": data.get("dispute_id")}
+        )
+        # Counted once even if the payment was also refunded
+        await dodo_service.record_payment_outcome(payment_id, PaymentStatus.REFUNDED)
+        logger.info(f"Dispute on payment {payment_id} lost")
+
+@webhook_dispatcher.on("subscription.active")
 async def handle_subscription_active(data: Dict[str, Any], dodo_service: DodoPaymentsService):
     """Handle subscription activation"""
     subscription_id = data.get("subscription_id")
@@ -225,10 +616,12 @@ async def handle_subscription_active(data: Dict[str, Any], dodo_service: DodoPay
         await dodo_service.update_subscription_status(
             subscription_id,
             SubscriptionStatus.ACTIVE,
-            {"webhook_data": data, "current_period_end": data.get("current_period_end")}
+            {"webhook_data": data},
+            **subscription_period(data)
         )
         logger.info(f"Subscription {subscription_id} activated")
 
+@webhook_dispatcher.on("subscription.on_hold")
 async def handle_subscription_on_hold(data: Dict[str, Any], dodo_service: DodoPaymentsService):
     """Handle subscription on hold"""
     subscription_id = data.get("subscription_id")
@@ -240,6 +633,7 @@ async def handle_subscription_on_hold(data: Dict[str, Any], dodo_service: DodoPa
         )
         logger.info(f"Subscription {subscription_id} on hold")
 
+@webhook_dispatcher.on("subscription.failed")
 async def handle_subscription_failed(data: Dict[str, Any], dodo_service: DodoPaymentsService):
     """Handle subscription failure"""
     subscription_id = data.get("subscription_id")
@@ -251,6 +645,31 @@ async def handle_subscription_failed(data: Dict[str, Any], dodo_service: DodoPay
         )
         logger.info(f"Subscription {subscription_id} failed")
 
+@webhook_dispatcher.on("subscription.cancelled")
+async def handle_subscription_cancelled(data: Dict[str, Any], dodo_service: DodoPaymentsService):
+    """Handle subscription cancellation"""
+    subscription_id = data.get("subscription_id")
+    if subscription_id:
+        await dodo_service.update_subscription_status(
+            subscription_id,
+            SubscriptionStatus.CANCELED,
+            {"webhook_data": data}
+        )
+        logger.info(f"Subscription {subscription_id} cancelled")
+
+@webhook_dispatcher.on("subscription.expired")
+async def handle_subscription_expired(data: Dict[str, Any], dodo_service: DodoPaymentsService):
+    """Handle subscription expiry"""
+    subscription_id = data.get("subscription_id")
+    if subscription_id:
+        await dodo_service.update_subscription_status(
+            subscription_id,
+            SubscriptionStatus.EXPIRED,
+            {"webhook_data": data}
+        )
+        logger.info(f"Subscription {subscription_id} expired")
+
+@webhook_dispatcher.on("subscription.renewed")
 async def handle_subscription_renewed(data: Dict[str, Any], dodo_service: DodoPaymentsService):
     """Handle subscription renewal"""
     subscription_id = data.get("subscription_id")
@@ -258,10 +677,12 @@ async def handle_subscription_renewed(data: Dict[str, Any], dodo_service: DodoPa
         await dodo_service.update_subscription_status(
             subscription_id,
             SubscriptionStatus.ACTIVE,
-            {"webhook_data": data, "current_period_end": data.get("current_period_end")}
+            {"webhook_data": data},
+            **subscription_period(data)
         )
         logger.info(f"Subscription {subscription_id} renewed")
 
+@webhook_dispatcher.on("subscription.plan_changed")
 async def handle_subscription_plan_changed(data: Dict[str, Any], dodo_service: DodoPaymentsService):
     """Handle subscription plan change"""
     subscription_id = data.get("subscription_id")
@@ -272,9 +693,9 @@ async def handle_subscription_plan_changed(data: Dict[str, Any], dodo_service: D
             {
                 "webhook_data": data,
                 "previous_plan": data.get("previous_plan"),
-                "new_plan": data.get("new_plan"),
-                "current_period_end": data.get("current_period_end")
-            }
+                "new_plan": data.get("new_plan")
+            },
+            **subscription_period(data)
         )
         logger.info(f"Subscription {subscription_id} plan changed")
 
@@ -295,12 +716,22 @@ async def test_simple_payment(
                 "quantity": 1
             }],
             return_url="http://localhost:3000/payment-success",
+            customer={"email": "test@example.com", "name": "Test Customer"},
+            billing={
+                "street": "123 Test Street",
+                "city": "San Francisco",
+                "state": "CA",
+                "country": "US",
+                "zipcode": "94105"
+            },
             metadata={"test": True, "source": "api_test"}
         )
         
         payment_response = await dodo_service.create_payment(test_payment)
         return payment_response
         
+    except AdmissionRejected as e:
+        raise overloaded(e)
     except Exception as e:
         logger.error(f"Error in test payment: {str(e)}")
         raise HTTPException(
@@ -1,9 +1,10 @@
 from fastapi import FastAPI, APIRouter
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import sys
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
@@ -16,16 +17,22 @@ sys.path.append(str(Path(__file__).parent))
 
 # Import payment routes and database utilities
 from routes.payments import router as payments_router
-from database import create_indexes, close_database_connection
+from database import (
+    create_indexes, close_database_connection, get_database, warm_database_pool
+)
+from routes.payments import process_webhook_event, webhook_dispatcher
+from metrics import PrometheusMiddleware, metrics_response
+from services.webhooks import webhook_secrets
+from health import readiness_probe
+from services.registry import (
+    init_dodo_service, close_dodo_service, webhook_processing_mode,
+    start_webhook_worker_pool, reconciler_enabled, start_payment_reconciler,
+    start_status_relays
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
 # Create the main app without a prefix
 app = FastAPI(title="Meta Generation Tool API", description="API with Dodo Payments integration")
 
@@ -50,26 +57,40 @@ async def root():
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
+    db = await get_database()
     _ = await db.status_checks.insert_one(status_obj.dict())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
 async def get_status_checks():
+    db = await get_database()
     status_checks = await db.status_checks.find().to_list(1000)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
+# Liveness: the process is up and serving requests
+@api_router.get("/health/live")
+async def liveness_check():
+    return {"status": "alive"}
+
+# Readiness: dependencies are reachable and startup work has finished
+@api_router.get("/health/ready")
+async def readiness_check():
+    readiness = await readiness_probe.check()
+    return JSONResponse(content=readiness, status_code=200 if readiness["ready"] else 503)
+
 # Health check endpoint for payment services
 @api_router.get("/health")
 async def health_check():
+    readiness = await readiness_probe.check()
     return {
         "status": "healthy",
         "dodo_payments": {
             "api_key_configured": bool(os.getenv("DODO_PAYMENTS_API_KEY")),
-            "webhook_secret_configured": bool(os.getenv("DODO_PAYMENTS_WEBHOOK_SECRET")),
+            "webhook_secret_configured": bool(webhook_secrets()),
             "mode": os.getenv("DODO_PAYMENTS_MODE", "test")
         },
         "database": {
-            "connected": True,
+            "connected": readiness["checks"]["mongo"],
             "name": os.environ.get('DB_NAME')
         }
     }
@@ -80,6 +101,11 @@ app.include_router(payments_router)
 # Include the main API router
 app.include_router(api_router)
 
+# Prometheus scrape endpoint (served directly by the backend, outside /api)
+app.add_route("/metrics", metrics_response, include_in_schema=False)
+
+app.add_middleware(PrometheusMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -95,21 +121,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database indexes on startup"""
+async def prepare_database():
+    """Warm the connection pool, then create indexes"""
+    try:
+        await warm_database_pool()
+    except Exception as e:
+        logger.error(f"Error warming database connection pool: {str(e)}")
+    
     try:
         await create_indexes()
         logger.info("Database indexes created successfully")
     except Exception as e:
         logger.error(f"Error creating database indexes: {str(e)}")
 
+async def start_payment_services():
+    """Initialize the Dodo client and the background workers that depend on it"""
+    try:
+        dodo_service = await init_dodo_service()
+        if webhook_processing_mode() == "async":
+            await start_webhook_worker_pool(
+                lambda event: process_webhook_event(event, dodo_service)
+            )
+        if reconciler_enabled():
+            await start_payment_reconciler(dodo_service)
+        await start_status_relays(dodo_service)
+    except Exception as e:
+        logger.error(f"Error initializing Dodo Payments client: {str(e)}")
+
+@app.on_event("startup")
+async def startup_event():
+    """Warm the database pool, create indexes and initialize the Dodo client on startup"""
+    # The Dodo SDK import is CPU-bound and the database work mostly waits on
+    # the network, so running them side by side shortens cold starts
+    await asyncio.gather(prepare_database(), start_payment_services())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    """Clean up database connections on shutdown"""
+    """Clean up database and Dodo Payments connections on shutdown"""
     try:
+        await webhook_dispatcher.drain()
+        await close_dodo_service()
         await close_database_connection()
-        client.close()
         logger.info("Database connections closed")
     except Exception as e:
         logger.error(f"Error closing database connections: {str(e)}")
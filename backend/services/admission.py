@@ -0,0 +1,113 @@
+"""
+Admission control for outbound Dodo API calls
+"""
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, AsyncIterator
+
+from services.stats import LatencyStats
+
+class AdmissionRejected(Exception):
+    """Raised when a call is shed instead of waiting for capacity"""
+
+    def __init__(self, name: str, reason: str, retry_after: int):
+        super().__init__(f"{name} is overloaded ({reason}), retry after {retry_after}s")
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Concurrency limit with a bounded wait queue
+
+    Up to max_concurrency calls run at once. Further callers wait in a queue of
+    at most max_queue, for at most queue_timeout seconds; anyone beyond that is
+    rejected immediately with AdmissionRejected. With max_queue and
+    queue_timeout left as None callers always wait and are never shed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._queue_wait = LatencyStats()
+        self._hold_time = LatencyStats()
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained"""
+        if not self._hold_time.count:
+            return 1
+        average = self._hold_time.total / self._hold_time.count
+        return max(1, math.ceil(average * (self.queued / self.max_concurrency + 1)))
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self.rejected += 1
+        return AdmissionRejected(self.name, reason, self.retry_after())
+
+    async def _acquire(self):
+        # Waiters still count as queued until their permit is granted
+        if self.max_queue is not None and self.queued + self.in_flight >= self.max_concurrency + self.max_queue:
+            raise self._reject("queue_full")
+
+        queued_at = time.perf_counter()
+        self.queued += 1
+        acquire = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            await asyncio.wait({acquire}, timeout=self.queue_timeout)
+            if not acquire.done():
+                acquire.cancel()
+            # A permit granted while the timeout fired is kept rather than leaked
+            try:
+                await acquire
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                raise self._reject("queue_timeout")
+        except BaseException:
+            if not acquire.done():
+                acquire.cancel()
+            elif not acquire.cancelled() and acquire.exception() is None:
+                self._semaphore.release()
+            raise
+        finally:
+            self.queued -= 1
+            self._queue_wait.observe(time.perf_counter() - queued_at)
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Hold one concurrency slot for the duration of the with-block"""
+        await self._acquire()
+        self.admitted += 1
+        self.in_flight += 1
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._hold_time.observe(time.perf_counter() - started_at)
+            self._semaphore.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "queue_wait": self._queue_wait.snapshot()
+        }
@@ -0,0 +1,107 @@
+"""
+Bounded in-process LRU cache with TTL expiry and request coalescing
+"""
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Awaitable, Hashable, Tuple
+
+class TTLCache:
+    """LRU cache whose entries expire after a TTL; concurrent misses share one load"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        self._generations: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry when full"""
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Drop a key; loads already in flight for it will not be cached"""
+        self._entries.pop(key, None)
+        if key in self._loading:
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        ttl_for: Optional[Callable[[Any], float]] = None
+    ) -> Any:
+        """Return the cached value, loading it once for all concurrent callers on a miss
+
+        ttl_for, if given, computes a per-entry TTL from the loaded value.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        pending = self._loading.get(key)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # Only the caller that started the load was cancelled; load again ourselves
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            return await self.get_or_load(key, loader, ttl_for)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        generation = self._generations.get(key, 0)
+        try:
+            value = await loader()
+        except BaseException as e:
+            # Waiters must be released even when the loading task is cancelled
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # Mark retrieved so waiter-less failures do not log "exception never retrieved"
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        else:
+            future.set_result(value)
+            if value is not None and self._generations.get(key, 0) == generation:
+                ttl = ttl_for(value) if ttl_for else None
+                if ttl is None or ttl > 0:
+                    self.set(key, value, ttl)
+            return value
+        finally:
+            del self._loading[key]
+            self._generations.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
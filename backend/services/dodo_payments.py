@@ -2,41 +2,91 @@
 Dodo Payments service integration
 """
 import os
-import sys
+import time
+import asyncio
 import logging
-from pathlib import Path
-from typing import Optional, Dict, Any
-from datetime import datetime
-import dodopayments
-from dodopayments import DodoPayments
+from typing import Optional, Union, Dict, Any, List, Callable, Awaitable, AsyncIterator, TYPE_CHECKING
+from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorCollection
-
-# Add the current directory to the Python path
-sys.path.append(str(Path(__file__).parent.parent))
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 from models.payment import (
     CreatePaymentRequest, PaymentResponse, CreateSubscriptionRequest, 
     SubscriptionResponse, PaymentRecord, SubscriptionRecord, PaymentStatus,
-    SubscriptionStatus
+    SubscriptionStatus, PaginatedRecords, BatchPaymentResult, EntitlementResponse,
+    PaymentRollup
 )
+from services.pagination import KEYSET_SORT, encode_cursor, keyset_query, projection_for
+from services.export import PAYMENT_EXPORT_FIELDS, stream_ndjson, stream_csv, gzip_stream
+from services.stats import LatencyStats
+from metrics import DODO_API_LATENCY, DODO_API_ERRORS, PAYMENT_ROLLUP_MISSES
+from services.write_batcher import BulkWriteBatcher
+from services.cache import TTLCache
+from services.idempotency import IdempotencyStore
+from services.pubsub import StatusBroker
+from services.webhooks import WebhookVerifier, webhook_secrets
+from services.admission import AdmissionController, AdmissionRejected
+
+if TYPE_CHECKING:
+    import httpx
 
 logger = logging.getLogger(__name__)
 
-# Add the current directory to the Python path
-sys.path.append(str(Path(__file__).parent.parent))
+# Dodo payment intent statuses that settle a payment
+DODO_PAYMENT_STATUSES = {
+    "succeeded": PaymentStatus.SUCCESS,
+    "failed": PaymentStatus.FAILED,
+    "cancelled": PaymentStatus.CANCELED
+}
 
-from models.payment import (
-    CreatePaymentRequest, PaymentResponse, CreateSubscriptionRequest, 
-    SubscriptionResponse, PaymentRecord, SubscriptionRecord, PaymentStatus,
-    SubscriptionStatus
-)
+def simulator_enabled() -> bool:
+    """Whether Dodo API calls are answered by the in-process simulator"""
+    return (
+        os.getenv("DODO_PAYMENTS_MODE", "test").lower() == "simulator"
+        or (os.getenv("DODO_PAYMENTS_API_URL") or "").startswith("simulator:")
+    )
 
-logger = logging.getLogger(__name__)
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """Parse an ISO-8601 timestamp from webhook data into a naive UTC datetime"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            logger.warning(f"Could not parse datetime value: {value}")
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def subscription_period(data: Dict[str, Any]) -> Dict[str, datetime]:
+    """Billing period fields from subscription webhook data, keyed by record field"""
+    period = {
+        "current_period_start": parse_datetime(
+            data.get("current_period_start") or data.get("previous_billing_date")
+        ),
+        "current_period_end": parse_datetime(
+            data.get("current_period_end") or data.get("next_billing_date")
+        )
+    }
+    return {field: value for field, value in period.items() if value is not None}
 
 class DodoPaymentsService:
-    def __init__(self, db_collections: Dict[str, AsyncIOMotorCollection]):
+    def __init__(
+        self,
+        db_collections: Dict[str, AsyncIOMotorCollection],
+        http_client: Optional["httpx.AsyncClient"] = None
+    ):
         self.api_key = os.getenv("DODO_PAYMENTS_API_KEY")
-        self.webhook_secret = os.getenv("DODO_PAYMENTS_WEBHOOK_SECRET")
+        self.webhook_verifier = WebhookVerifier(
+            webhook_secrets(),
+            tolerance_seconds=int(os.getenv("WEBHOOK_TIMESTAMP_TOLERANCE_SECONDS", "300"))
+        )
+        self.webhook_max_body_bytes = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", str(1024 * 1024)))
         self.mode = os.getenv("DODO_PAYMENTS_MODE", "test")
         api_url = os.getenv("DODO_PAYMENTS_API_URL")
         
@@ -54,18 +104,242 @@ class DodoPaymentsService:
         else:
             client_kwargs["environment"] = "live_mode"
             
-        # Set custom base URL if provided
-        if api_url:
+        # Set custom base URL if provided; the simulator is served in-process
+        # by the HTTP client's transport (see services/dodo_simulator.py)
+        if simulator_enabled():
+            from services.dodo_simulator import SIMULATOR_BASE_URL
+            client_kwargs["base_url"] = SIMULATOR_BASE_URL
+        elif api_url:
             client_kwargs["base_url"] = api_url
+        
+        # Reuse the application-wide connection pool when one is provided
+        if http_client is not None:
+            client_kwargs["http_client"] = http_client
             
         logger.info(f"Initializing Dodo Payments client in {self.mode} mode with environment: {client_kwargs.get('environment')}")
         
-        self.client = DodoPayments(**client_kwargs)
+        # The SDK takes a large share of import time, so it is loaded on first use
+        from dodopayments import AsyncDodoPayments
+        self.client = AsyncDodoPayments(**client_kwargs)
+        
+        # Bound outbound Dodo API calls. Customer-facing calls are shed once the
+        # wait queue is full; background work such as reconciliation always waits.
+        self.checkout_admission = AdmissionController(
+            "checkout",
+            max_concurrency=int(os.getenv("DODO_PAYMENTS_MAX_CONCURRENCY", "20")),
+            max_queue=int(os.getenv("DODO_PAYMENTS_MAX_QUEUE", "50")),
+            queue_timeout=float(os.getenv("DODO_PAYMENTS_QUEUE_TIMEOUT_SECONDS", "5"))
+        )
+        self.background_admission = AdmissionController(
+            "background",
+            max_concurrency=int(os.getenv("DODO_BACKGROUND_MAX_CONCURRENCY", "5"))
+        )
+        self._api_latency: Dict[str, LatencyStats] = {}
+        
+        # Fan-out limit for a single bulk checkout request
+        self.batch_concurrency = int(os.getenv("DODO_BATCH_CONCURRENCY", "10"))
         
         # Database collections
         self.payments_collection = db_collections.get("payments")
         self.subscriptions_collection = db_collections.get("subscriptions")
+        self.webhook_events_collection = db_collections.get("webhook_events")
+        self.payment_rollups_collection = db_collections.get("payment_rollups")
+        
+        # How long processed webhook ids are remembered for de-duplication
+        self.webhook_event_ttl = timedelta(
+            seconds=int(os.getenv("WEBHOOK_EVENT_TTL_SECONDS", str(7 * 24 * 3600)))
+        )
+        # How long a delivery may stay in processing before a retry takes it over
+        self.webhook_processing_lease = timedelta(
+            seconds=int(os.getenv("WEBHOOK_PROCESSING_LEASE_SECONDS", "60"))
+        )
         
+        # Coalesce webhook-driven status updates into bulk writes (0 ms disables batching)
+        self._payment_batcher: Optional[BulkWriteBatcher] = None
+        self._subscription_batcher: Optional[BulkWriteBatcher] = None
+        batch_delay = float(os.getenv("STATUS_BATCH_MAX_DELAY_MS", "5")) / 1000
+        batch_size = int(os.getenv("STATUS_BATCH_MAX_OPS", "500"))
+        if batch_delay > 0:
+            if self.payments_collection is not None:
+                self._payment_batcher = BulkWriteBatcher(
+                    self.payments_collection, "payment_id", batch_size, batch_delay
+                )
+            if self.subscriptions_collection is not None:
+                self._subscription_batcher = BulkWriteBatcher(
+                    self.subscriptions_collection, "subscription_id", batch_size, batch_delay
+                )
+        
+        # Stored responses for requests carrying an Idempotency-Key
+        self.idempotency: Optional[IdempotencyStore] = None
+        if db_collections.get("idempotency_keys") is not None:
+            self.idempotency = IdempotencyStore(db_collections["idempotency_keys"])
+        
+        # Read-through cache for payment lookups, invalidated on status changes
+        self.payment_cache = TTLCache(
+            max_size=int(os.getenv("PAYMENT_CACHE_MAX_SIZE", "10000")),
+            ttl=float(os.getenv("PAYMENT_CACHE_TTL_SECONDS", "30"))
+        )
+        
+        # Entitlement cache per user_id; positive entries never outlive current_period_end
+        self.entitlement_cache = TTLCache(
+            max_size=int(os.getenv("ENTITLEMENT_CACHE_MAX_SIZE", "50000")),
+            ttl=float(os.getenv("ENTITLEMENT_CACHE_TTL_SECONDS", "60"))
+        )
+        self.entitlement_negative_ttl = float(os.getenv("ENTITLEMENT_NEGATIVE_TTL_SECONDS", "5"))
+        # subscription_id -> user_id for cached positive entries, expiring with them
+        self._entitled_users = TTLCache(
+            max_size=self.entitlement_cache.max_size,
+            ttl=self.entitlement_cache.ttl
+        )
+        
+        # Status change fan-out for server-sent event listeners. "local" only reaches
+        # this process; "change_stream" (replica set required) relays every worker's
+        # writes and invalidates the caches above, so it is needed with several workers
+        self.status_broker = StatusBroker()
+        self.status_events_source = os.getenv("STATUS_EVENTS_SOURCE", "local").lower()
+        
+    async def close(self):
+        """Flush pending batched writes"""
+        for batcher in (self._payment_batcher, self._subscription_batcher):
+            if batcher is not None:
+                await batcher.flush()
+    
+    def get_batch_stats(self) -> Dict[str, Any]:
+        """Statistics for the status update batchers"""
+        return {
+            "payments": self._payment_batcher.get_stats() if self._payment_batcher else None,
+            "subscriptions": self._subscription_batcher.get_stats() if self._subscription_batcher else None
+        }
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters for the in-process caches"""
+        return {
+            "payments": self.payment_cache.get_stats(),
+            "entitlements": self.entitlement_cache.get_stats()
+        }
+    
+    async def _call_dodo(
+        self,
+        name: str,
+        method: Callable[..., Awaitable[Any]],
+        admission: Optional[AdmissionController] = None,
+        **kwargs
+    ) -> Any:
+        """Call the Dodo API once admitted, recording latency
+
+        Raises AdmissionRejected when the checkout limiter is saturated.
+        """
+        async with (admission or self.checkout_admission).admit():
+            started_at = time.perf_counter()
+            try:
+                return await method(**kwargs)
+            except Exception as e:
+                DODO_API_ERRORS.labels(name, type(e).__name__).inc()
+                raise
+            finally:
+                elapsed = time.perf_counter() - started_at
+                self._api_latency.setdefault(name, LatencyStats()).observe(elapsed)
+                DODO_API_LATENCY.labels(name).observe(elapsed)
+    
+    def get_api_stats(self) -> Dict[str, Any]:
+        """Admission and latency statistics for Dodo API calls"""
+        return {
+            "checkout": self.checkout_admission.get_stats(),
+            "background": self.background_admission.get_stats(),
+            "latency": {name: stats.snapshot() for name, stats in self._api_latency.items()}
+        }
+    
+    def _payment_payload(self, payment_request: CreatePaymentRequest) -> Dict[str, Any]:
+        """Format a payment request for the Dodo Payments API"""
+        payment_data = {
+            "billing_currency": payment_request.billing_currency,
+            "allowed_payment_method_types": payment_request.allowed_payment_method_types,
+            "product_cart": [
+                {
+                    "amount": item.amount,
+                    "product_id": item.product_id,
+                    "quantity": item.quantity
+                }
+                for item in payment_request.product_cart
+            ],
+            "return_url": payment_request.return_url,
+            "payment_link": True,
+            "metadata": payment_request.metadata or {}
+        }
+        
+        # Add customer if provided
+        if payment_request.customer:
+            customer_data = {}
+            if payment_request.customer.customer_id:
+                customer_data["customer_id"] = payment_request.customer.customer_id
+            if payment_request.customer.email:
+                customer_data["email"] = payment_request.customer.email
+            if payment_request.customer.name:
+                customer_data["name"] = payment_request.customer.name
+            
+            if customer_data:
+                payment_data["customer"] = customer_data
+        
+        # Add billing address if provided
+        if payment_request.billing:
+            payment_data["billing"] = {
+                "street": payment_request.billing.street,
+                "city": payment_request.billing.city,
+                "state": payment_request.billing.state,
+                "country": payment_request.billing.country,
+                "zipcode": payment_request.billing.zipcode
+            }
+        
+        return payment_data
+    
+    def _payment_record(
+        self,
+        payment_id: str,
+        payment_request: CreatePaymentRequest,
+        user_id: Optional[str]
+    ) -> PaymentRecord:
+        """Build the pending payment record stored after a successful API call"""
+        now = datetime.utcnow()
+        return PaymentRecord(
+            id=payment_id,
+            payment_id=payment_id,
+            user_id=user_id,
+            customer_id=payment_request.customer.customer_id if payment_request.customer else None,
+            amount=sum(item.amount for item in payment_request.product_cart),
+            currency=payment_request.billing_currency,
+            status=PaymentStatus.PENDING,
+            product_id=payment_request.product_cart[0].product_id if payment_request.product_cart else None,
+            metadata=payment_request.metadata,
+            created_at=now,
+            updated_at=now
+        )
+    
+    def _payment_response(self, response: Any) -> PaymentResponse:
+        """Map the SDK's PaymentCreateResponse, which has no status, to a pending payment"""
+        expires_on = getattr(response, 'expires_on', None)
+        return PaymentResponse(
+            id=response.payment_id,
+            url=response.payment_link or "",
+            checkout_url=response.payment_link,
+            status=PaymentStatus.PENDING.value,
+            expires_at=expires_on.isoformat() if expires_on else None
+        )
+    
+    @staticmethod
+    def is_mock_response(response: Union[PaymentResponse, SubscriptionResponse]) -> bool:
+        """True for the placeholder responses test mode returns when the API call fails"""
+        response_id = getattr(response, "id", None) or getattr(response, "subscription_id", "")
+        return response_id.startswith("mock_")
+    
+    def _mock_payment_response(self, suffix: str = "") -> PaymentResponse:
+        mock_id = f"mock_payment_{int(datetime.utcnow().timestamp())}{suffix}"
+        return PaymentResponse(
+            id=mock_id,
+            url=f"https://checkout.dodopayments.com/mock/{mock_id}",
+            status="pending",
+            expires_at=datetime.utcnow().isoformat()
+        )
+    
     async def create_payment(
         self, 
         payment_request: CreatePaymentRequest,
@@ -73,45 +347,7 @@ class DodoPaymentsService:
     ) -> PaymentResponse:
         """Create a one-time payment"""
         try:
-            # Format request for Dodo Payments API
-            payment_data = {
-                "billing_currency": payment_request.billing_currency,
-                "allowed_payment_method_types": payment_request.allowed_payment_method_types,
-                "product_cart": [
-                    {
-                        "amount": item.amount,
-                        "product_id": item.product_id,
-                        "quantity": item.quantity
-                    }
-                    for item in payment_request.product_cart
-                ],
-                "return_url": payment_request.return_url,
-                "payment_link": True,
-                "metadata": payment_request.metadata or {}
-            }
-            
-            # Add customer if provided
-            if payment_request.customer:
-                customer_data = {}
-                if payment_request.customer.customer_id:
-                    customer_data["customer_id"] = payment_request.customer.customer_id
-                if payment_request.customer.email:
-                    customer_data["email"] = payment_request.customer.email
-                if payment_request.customer.name:
-                    customer_data["name"] = payment_request.customer.name
-                
-                if customer_data:
-                    payment_data["customer"] = customer_data
-            
-            # Add billing address if provided
-            if payment_request.billing:
-                payment_data["billing"] = {
-                    "street": payment_request.billing.street,
-                    "city": payment_request.billing.city,
-                    "state": payment_request.billing.state,
-                    "country": payment_request.billing.country,
-                    "zipcode": payment_request.billing.zipcode
-                }
+            payment_data = self._payment_payload(payment_request)
             
             # Log the attempt
             logger.info(f"Creating payment with Dodo Payments API in {self.mode} mode")
@@ -119,38 +355,21 @@ class DodoPaymentsService:
             
             # Create payment with Dodo Payments
             try:
-                response = self.client.payments.create(**payment_data)
-                logger.info(f"Successfully created payment with Dodo Payments API: {response.id}")
+                response = await self._call_dodo("payments.create", self.client.payments.create, **payment_data)
+                logger.info(f"Successfully created payment with Dodo Payments API: {response.payment_id}")
             except Exception as api_error:
                 logger.error(f"Error calling Dodo Payments API: {str(api_error)}")
                 raise
             
             # Save payment record to database
-            if self.payments_collection:
-                payment_record = PaymentRecord(
-                    id=response.id,
-                    payment_id=response.id,
-                    user_id=user_id,
-                    customer_id=payment_request.customer.customer_id if payment_request.customer else None,
-                    amount=sum(item.amount for item in payment_request.product_cart),
-                    currency=payment_request.billing_currency,
-                    status=PaymentStatus.PENDING,
-                    product_id=payment_request.product_cart[0].product_id if payment_request.product_cart else None,
-                    metadata=payment_request.metadata,
-                    created_at=datetime.utcnow(),
-                    updated_at=datetime.utcnow()
-                )
-                
+            if self.payments_collection is not None:
+                payment_record = self._payment_record(response.payment_id, payment_request, user_id)
                 await self.payments_collection.insert_one(payment_record.dict(by_alias=True))
             
-            return PaymentResponse(
-                id=response.id,
-                url=response.url,
-                checkout_url=getattr(response, 'checkout_url', response.url),
-                status=response.status,
-                expires_at=getattr(response, 'expires_at', None)
-            )
+            return self._payment_response(response)
             
+        except AdmissionRejected:
+            raise
         except Exception as e:
             logger.error(f"Error creating payment: {str(e)}")
             logger.error(f"Error type: {type(e)}")
@@ -159,15 +378,63 @@ class DodoPaymentsService:
             # In test mode, return a mock response if API fails - but log the actual error
             if self.mode == "test":
                 logger.warning("API call failed in test mode, returning mock response for debugging")
-                mock_id = f"mock_payment_{int(datetime.utcnow().timestamp())}"
-                return PaymentResponse(
-                    id=mock_id,
-                    url=f"https://checkout.dodopayments.com/mock/{mock_id}",
-                    status="pending",
-                    expires_at=datetime.utcnow().isoformat()
-                )
+                return self._mock_payment_response()
             raise
     
+    async def create_payments_batch(
+        self,
+        payment_requests: List[CreatePaymentRequest],
+        user_id: Optional[str] = None
+    ) -> List[BatchPaymentResult]:
+        """Create many payments concurrently and persist their records with one insert_many"""
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        
+        async def create_one(index: int, payment_request: CreatePaymentRequest):
+            async with semaphore:
+                try:
+                    response = await self._call_dodo(
+                        "payments.create", self.client.payments.create,
+                        **self._payment_payload(payment_request)
+                    )
+                    return response, None
+                except Exception as e:
+                    logger.error(f"Error creating payment {index} in batch: {str(e)}")
+                    return None, e
+        
+        outcomes = await asyncio.gather(*[
+            create_one(index, payment_request) for index, payment_request in enumerate(payment_requests)
+        ])
+        
+        results: List[BatchPaymentResult] = []
+        records = []
+        for index, (response, error) in enumerate(outcomes):
+            if response is not None:
+                results.append(BatchPaymentResult(index=index, payment=self._payment_response(response)))
+                records.append((index, self._payment_record(response.payment_id, payment_requests[index], user_id)))
+            elif self.mode == "test" and not isinstance(error, AdmissionRejected):
+                # Match create_payment: test mode falls back to a mock response
+                results.append(BatchPaymentResult(index=index, payment=self._mock_payment_response(f"_{index}")))
+            else:
+                results.append(BatchPaymentResult(index=index, error=str(error)))
+        
+        # Save every created payment in one round-trip
+        if records and self.payments_collection is not None:
+            try:
+                await self.payments_collection.insert_many(
+                    [record.dict(by_alias=True) for _, record in records], ordered=False
+                )
+            except BulkWriteError as e:
+                for write_error in e.details.get("writeErrors", []):
+                    index = records[write_error["index"]][0]
+                    logger.error(f"Error saving payment {index} in batch: {write_error.get('errmsg')}")
+                    results[index] = BatchPaymentResult(
+                        index=index,
+                        payment=results[index].payment,
+                        error=f"Payment created but not saved: {write_error.get('errmsg')}"
+                    )
+        
+        return results
+    
     async def create_subscription(
         self,
         subscription_request: CreateSubscriptionRequest,
@@ -183,6 +450,7 @@ class DodoPaymentsService:
                     "name": subscription_request.customer.name
                 },
                 "product_id": subscription_request.product_id,
+                "quantity": subscription_request.quantity,
                 "billing": {
                     "street": subscription_request.billing.street,
                     "city": subscription_request.billing.city,
@@ -198,17 +466,18 @@ class DodoPaymentsService:
                 subscription_data["subscription_id"] = subscription_request.subscription_id
             
             # Create subscription with Dodo Payments
-            response = self.client.subscriptions.create(**subscription_data)
+            response = await self._call_dodo("subscriptions.create", self.client.subscriptions.create, **subscription_data)
             
             # Save subscription record to database
-            if self.subscriptions_collection:
+            if self.subscriptions_collection is not None:
                 subscription_record = SubscriptionRecord(
                     id=response.subscription_id,
                     subscription_id=response.subscription_id,
                     user_id=user_id,
                     customer_id=subscription_request.customer.customer_id,
                     product_id=subscription_request.product_id,
-                    status=SubscriptionStatus.PENDING if hasattr(SubscriptionStatus, 'PENDING') else SubscriptionStatus.ACTIVE,
+                    # Only subscription webhooks activate it, once the first payment clears
+                    status=SubscriptionStatus.PENDING,
                     metadata=subscription_request.metadata,
                     created_at=datetime.utcnow(),
                     updated_at=datetime.utcnow()
@@ -219,11 +488,13 @@ class DodoPaymentsService:
             return SubscriptionResponse(
                 subscription_id=response.subscription_id,
                 customer_id=subscription_request.customer.customer_id,
-                status=response.status,
+                status=SubscriptionStatus.PENDING.value,
                 product_id=subscription_request.product_id,
-                payment_url=getattr(response, 'payment_url', None)
+                payment_url=response.payment_link
             )
             
+        except AdmissionRejected:
+            raise
         except Exception as e:
             logger.error(f"Error creating subscription: {str(e)}")
             # In test mode, return a mock response if API fails
@@ -240,22 +511,186 @@ class DodoPaymentsService:
     
     async def get_payment(self, payment_id: str) -> Optional[PaymentRecord]:
         """Get payment by ID"""
-        if not self.payments_collection:
+        if self.payments_collection is None:
             return None
-            
+        
+        return await self.payment_cache.get_or_load(
+            payment_id, lambda: self._load_payment(payment_id)
+        )
+    
+    async def _load_payment(self, payment_id: str) -> Optional[PaymentRecord]:
         payment_data = await self.payments_collection.find_one({"payment_id": payment_id})
         if payment_data:
             return PaymentRecord(**payment_data)
         return None
     
+    async def get_entitlement(self, user_id: str) -> EntitlementResponse:
+        """Whether the user has an active subscription right now"""
+        entitlement = await self.entitlement_cache.get_or_load(
+            user_id, lambda: self._load_entitlement(user_id), self._entitlement_ttl
+        )
+        # Guard against clock skew between the monotonic TTL and period end
+        if entitlement.active and entitlement.current_period_end and entitlement.current_period_end <= datetime.utcnow():
+            self.entitlement_cache.invalidate(user_id)
+            return EntitlementResponse(user_id=user_id, active=False)
+        return entitlement
+    
+    async def _load_entitlement(self, user_id: str) -> EntitlementResponse:
+        if self.subscriptions_collection is None:
+            return EntitlementResponse(user_id=user_id, active=False)
+        
+        now = datetime.utcnow()
+        subscription = await self.subscriptions_collection.find_one(
+            {
+                "user_id": user_id,
+                "status": SubscriptionStatus.ACTIVE,
+                "current_period_end": {"$gt": now}
+            },
+            {"subscription_id": 1, "current_period_end": 1},
+            sort=[("current_period_end", -1)]
+        )
+        if subscription is None:
+            return EntitlementResponse(user_id=user_id, active=False)
+        
+        entitlement = EntitlementResponse(
+            user_id=user_id,
+            active=True,
+            subscription_id=subscription["subscription_id"],
+            current_period_end=subscription.get("current_period_end")
+        )
+        self._entitled_users.set(subscription["subscription_id"], user_id, self._entitlement_ttl(entitlement))
+        return entitlement
+    
+    def _entitlement_ttl(self, entitlement: EntitlementResponse) -> float:
+        if not entitlement.active:
+            return self.entitlement_negative_ttl
+        ttl = self.entitlement_cache.ttl
+        if entitlement.current_period_end is not None:
+            ttl = min(ttl, (entitlement.current_period_end - datetime.utcnow()).total_seconds())
+        return ttl
+    
+    def _invalidate_entitlement(self, subscription_id: str):
+        """Drop the cached entitlement granted by a subscription whose status changed
+
+        Users without a cached grant can only hold a "not entitled" answer, which
+        expires after entitlement_negative_ttl, so no lookup is needed for them.
+        """
+        user_id = self._entitled_users.get(subscription_id)
+        if user_id:
+            self._entitled_users.invalidate(subscription_id)
+            self.entitlement_cache.invalidate(user_id)
+    
+    def invalidate_cached(self, kind: str, record_id: str, doc: Dict[str, Any]):
+        """Drop cache entries made stale by a status change written in any worker"""
+        if kind == "payment":
+            self.payment_cache.invalidate(record_id)
+        elif doc.get("user_id"):
+            self._entitled_users.invalidate(record_id)
+            self.entitlement_cache.invalidate(doc["user_id"])
+    
+    async def list_payments(
+        self,
+        user_id: Optional[str] = None,
+        customer_id: Optional[str] = None,
+        status: Optional[PaymentStatus] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50,
+        fields: Optional[str] = None,
+        include_metadata: bool = False
+    ) -> PaginatedRecords:
+        """List payments newest first using keyset pagination"""
+        if self.payments_collection is None:
+            return PaginatedRecords(items=[])
+        
+        query = keyset_query(
+            {"user_id": user_id, "customer_id": customer_id, "status": status},
+            cursor, created_after, created_before
+        )
+        return await self._list_page(
+            self.payments_collection, query, projection_for(fields, include_metadata), limit
+        )
+    
+    async def list_subscriptions(
+        self,
+        user_id: Optional[str] = None,
+        customer_id: Optional[str] = None,
+        status: Optional[SubscriptionStatus] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50,
+        fields: Optional[str] = None,
+        include_metadata: bool = False
+    ) -> PaginatedRecords:
+        """List subscriptions newest first using keyset pagination"""
+        if self.subscriptions_collection is None:
+            return PaginatedRecords(items=[])
+        
+        query = keyset_query(
+            {"user_id": user_id, "customer_id": customer_id, "status": status},
+            cursor, created_after, created_before
+        )
+        return await self._list_page(
+            self.subscriptions_collection, query, projection_for(fields, include_metadata), limit
+        )
+    
+    def export_payments(
+        self,
+        export_format: str = "ndjson",
+        status: Optional[PaymentStatus] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        include_metadata: bool = False,
+        compress: bool = False
+    ) -> AsyncIterator[bytes]:
+        """Stream payments oldest first as NDJSON or CSV without materializing them"""
+        query = keyset_query({"status": status}, None, created_after, created_before)
+        if export_format == "csv":
+            projection = {field: 1 for field in PAYMENT_EXPORT_FIELDS}
+        else:
+            projection = projection_for(None, include_metadata)
+        
+        batch_size = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+        cursor = self.payments_collection.find(
+            query, projection, batch_size=batch_size
+        ).sort([("created_at", 1), ("_id", 1)])
+        
+        if export_format == "csv":
+            chunks = stream_csv(cursor, batch_size)
+        else:
+            chunks = stream_ndjson(cursor, batch_size)
+        return gzip_stream(chunks) if compress else chunks
+    
+    async def _list_page(
+        self,
+        collection: AsyncIOMotorCollection,
+        query: Dict[str, Any],
+        projection: Optional[Dict[str, int]],
+        limit: int
+    ) -> PaginatedRecords:
+        # Fetch one extra document to know whether another page exists
+        docs = await collection.find(query, projection).sort(KEYSET_SORT).limit(limit + 1).to_list(limit + 1)
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            last = docs[-1]
+            next_cursor = encode_cursor(last["created_at"], last["_id"])
+        return PaginatedRecords(items=docs, next_cursor=next_cursor)
+    
     async def update_payment_status(
         self, 
         payment_id: str, 
         status: PaymentStatus,
         metadata: Optional[Dict[str, Any]] = None
     ) -> bool:
-        """Update payment status"""
-        if not self.payments_collection:
+        """Update payment status
+        
+        When batching is enabled the update is written as part of a bulk_write and
+        the result is True once it has been applied without error.
+        """
+        if self.payments_collection is None:
             return False
             
         update_data = {
@@ -266,21 +701,142 @@ class DodoPaymentsService:
         if metadata:
             update_data["metadata"] = metadata
         
-        result = await self.payments_collection.update_one(
-            {"payment_id": payment_id},
-            {"$set": update_data}
+        try:
+            if self._payment_batcher is not None:
+                applied = await self._payment_batcher.submit(payment_id, update_data)
+            else:
+                result = await self.payments_collection.update_one(
+                    {"payment_id": payment_id},
+                    {"$set": update_data}
+                )
+                applied = result.modified_count > 0
+        finally:
+            self.payment_cache.invalidate(payment_id)
+        
+        if applied:
+            self._publish_status("payment", payment_id, status, update_data["updated_at"])
+        return applied
+    
+    async def record_payment_outcome(self, payment_id: str, outcome: PaymentStatus) -> bool:
+        """Add a settled payment to the daily rollups, at most once per outcome
+
+        Each outcome a payment reaches is counted on the day it was reached,
+        recorded in outcome_at so `manage.py rebuild-payment-rollups` can
+        recompute exactly the same totals. Success and failed totals are gross:
+        a full refund or lost dispute does not subtract from them but adds the
+        payment to the refunded totals on the day it happened, so net revenue
+        is success_amount - refunded_amount. Partial refunds are not counted.
+        """
+        if self.payments_collection is None or self.payment_rollups_collection is None:
+            return False
+        
+        # Mark the payment first so redelivered events never count twice
+        now = datetime.utcnow()
+        payment = await self.payments_collection.find_one_and_update(
+            {"payment_id": payment_id, "rolled_up": {"$ne": outcome}},
+            {"$addToSet": {"rolled_up": outcome}, "$set": {f"outcome_at.{outcome.value}": now}},
+            projection={"amount": 1, "currency": 1, "product_id": 1},
+            return_document=ReturnDocument.AFTER
         )
+        if payment is None:
+            if await self.payments_collection.count_documents({"payment_id": payment_id}, limit=1) == 0:
+                # Nothing to count against, e.g. a payment created outside this backend
+                PAYMENT_ROLLUP_MISSES.labels(outcome.value).inc()
+                logger.warning(f"Payment {payment_id} not found, {outcome.value} outcome left out of rollups")
+            return False
+        
+        day = now.strftime("%Y-%m-%d")
+        product_id = payment.get("product_id")
+        currency = payment.get("currency")
+        await self.payment_rollups_collection.update_one(
+            {"_id": f"{day}:{product_id}:{currency}"},
+            {
+                "$inc": {f"{outcome.value}_count": 1, f"{outcome.value}_amount": payment.get("amount", 0)},
+                "$setOnInsert": {"day": day, "product_id": product_id, "currency": currency}
+            },
+            upsert=True
+        )
+        return True
+    
+    async def get_payment_rollups(
+        self,
+        start_day: Optional[str] = None,
+        end_day: Optional[str] = None,
+        product_id: Optional[str] = None,
+        currency: Optional[str] = None
+    ) -> List[PaymentRollup]:
+        """Pre-aggregated payment counts and amounts for a range of days"""
+        if self.payment_rollups_collection is None:
+            return []
+        
+        query: Dict[str, Any] = {}
+        day_range = {}
+        if start_day:
+            day_range["$gte"] = start_day
+        if end_day:
+            day_range["$lte"] = end_day
+        if day_range:
+            query["day"] = day_range
+        if product_id:
+            query["product_id"] = product_id
+        if currency:
+            query["currency"] = currency
         
-        return result.modified_count > 0
+        docs = await self.payment_rollups_collection.find(query, {"_id": 0}).sort("day", 1).to_list(None)
+        return [PaymentRollup(**doc) for doc in docs]
+    
+    async def fetch_payment_status(self, payment_id: str) -> Optional[PaymentStatus]:
+        """Current status of a payment according to the Dodo API"""
+        payment = await self._call_dodo(
+            "payments.retrieve", self.client.payments.retrieve,
+            admission=self.background_admission, payment_id=payment_id
+        )
+        return DODO_PAYMENT_STATUSES.get(getattr(payment, "status", None), PaymentStatus.PENDING)
+    
+    async def apply_payment_corrections(self, corrections: Dict[str, PaymentStatus]) -> int:
+        """Set reconciled statuses on still-pending payments in one bulk_write"""
+        if not corrections or self.payments_collection is None:
+            return 0
+        
+        now = datetime.utcnow()
+        requests = [
+            UpdateOne(
+                {"payment_id": payment_id, "status": PaymentStatus.PENDING},
+                {"$set": {"status": payment_status, "updated_at": now, "reconciled_at": now}}
+            )
+            for payment_id, payment_status in corrections.items()
+        ]
+        try:
+            result = await self.payments_collection.bulk_write(requests, ordered=False)
+        finally:
+            for payment_id in corrections:
+                self.payment_cache.invalidate(payment_id)
+        
+        # Rows a webhook settled first were left alone and must not be announced again
+        applied = list(corrections)
+        if result.modified_count < len(corrections):
+            docs = await self.payments_collection.find(
+                {"payment_id": {"$in": applied}, "reconciled_at": now}, {"payment_id": 1}
+            ).to_list(None)
+            applied = [doc["payment_id"] for doc in docs]
+        
+        for payment_id in applied:
+            payment_status = corrections[payment_id]
+            self._publish_status("payment", payment_id, payment_status, now)
+            if payment_status in (PaymentStatus.SUCCESS, PaymentStatus.FAILED):
+                await self.record_payment_outcome(payment_id, payment_status)
+        return result.modified_count
     
     async def update_subscription_status(
         self,
         subscription_id: str,
         status: SubscriptionStatus,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        current_period_start: Optional[datetime] = None,
+        current_period_end: Optional[datetime] = None
     ) -> bool:
-        """Update subscription status"""
-        if not self.subscriptions_collection:
+        """Update subscription status (batched like update_payment_status)"""
+        if self.subscriptions_collection is None:
             return False
             
         update_data = {
@@ -291,9 +847,109 @@ class DodoPaymentsService:
         if metadata:
             update_data["metadata"] = metadata
         
-        result = await self.subscriptions_collection.update_one(
-            {"subscription_id": subscription_id},
-            {"$set": update_data}
+        if current_period_start is not None:
+            update_data["current_period_start"] = current_period_start
+        if current_period_end is not None:
+            update_data["current_period_end"] = current_period_end
+        
+        try:
+            if self._subscription_batcher is not None:
+                applied = await self._subscription_batcher.submit(subscription_id, update_data)
+            else:
+                result = await self.subscriptions_collection.update_one(
+                    {"subscription_id": subscription_id},
+                    {"$set": update_data}
+                )
+                applied = result.modified_count > 0
+        finally:
+            self._invalidate_entitlement(subscription_id)
+        
+        if applied:
+            self._publish_status("subscription", subscription_id, status, update_data["updated_at"])
+        return applied
+    
+    def _publish_status(self, kind: str, record_id: str, status: str, updated_at: datetime):
+        """Notify status stream listeners, unless a change stream relays writes instead"""
+        if self.status_events_source == "local":
+            self.status_broker.publish((kind, record_id), {"status": status, "updated_at": updated_at})
+    
+    async def get_subscription(self, subscription_id: str) -> Optional[SubscriptionRecord]:
+        """Get subscription by ID"""
+        if self.subscriptions_collection is None:
+            return None
+        
+        subscription_data = await self.subscriptions_collection.find_one({"subscription_id": subscription_id})
+        if subscription_data:
+            return SubscriptionRecord(**subscription_data)
+        return None
+    
+    async def get_current_status(self, kind: str, record_id: str) -> Optional[Dict[str, Any]]:
+        """Status and updated_at of a payment or subscription, read from Mongo past any cache"""
+        collection, id_field = {
+            "payment": (self.payments_collection, "payment_id"),
+            "subscription": (self.subscriptions_collection, "subscription_id")
+        }[kind]
+        if collection is None:
+            return None
+        
+        return await collection.find_one({id_field: record_id}, {"_id": 0, "status": 1, "updated_at": 1})
+    
+    async def record_webhook_event(self, event_id: str, event_type: str, claim: str) -> Optional[str]:
+        """Claim a webhook delivery for processing under a token unique to this attempt
+
+        Returns None when this request holds the claim, otherwise the status of
+        the existing record: "processed", or "processing" while another attempt
+        holds an unexpired lease.
+        """
+        if self.webhook_events_collection is None:
+            return None
+        
+        now = datetime.utcnow()
+        try:
+            await self.webhook_events_collection.insert_one({
+                "event_id": event_id,
+                "type": event_type,
+                "status": "processing",
+                "claim": claim,
+                "processing_until": now + self.webhook_processing_lease,
+                "created_at": now,
+                "expires_at": now + self.webhook_event_ttl
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+        
+        # Take over a delivery whose attempt died or overran its lease
+        result = await self.webhook_events_collection.update_one(
+            {"event_id": event_id, "status": "processing", "processing_until": {"$not": {"$gt": now}}},
+            {"$set": {"claim": claim, "processing_until": now + self.webhook_processing_lease}}
+        )
+        if result.modified_count:
+            return None
+        
+        existing = await self.webhook_events_collection.find_one({"event_id": event_id}, {"status": 1})
+        # A record released in the meantime is reported as in progress so the sender retries
+        return existing.get("status", "processing") if existing else "processing"
+    
+    async def mark_webhook_event_processed(self, event_id: str):
+        """Mark a recorded webhook delivery as processed"""
+        if self.webhook_events_collection is None:
+            return
+        
+        await self.webhook_events_collection.update_one(
+            {"event_id": event_id},
+            {"$set": {"status": "processed", "processed_at": datetime.utcnow()}}
         )
+    
+    async def release_webhook_event(self, event_id: str, claim: str):
+        """Forget a webhook delivery that failed so a retry can process it again
+
+        Only this attempt's own claim is dropped; one taken over after its lease
+        expired belongs to the newer attempt.
+        """
+        if self.webhook_events_collection is None:
+            return
         
-        return result.modified_count > 0
+        await self.webhook_events_collection.delete_one(
+            {"event_id": event_id, "status": "processing", "claim": claim}
+        )
@@ -0,0 +1,252 @@
+"""
+In-process stand-in for the Dodo Payments API, for offline development and load tests
+
+Enable with DODO_PAYMENTS_MODE=simulator or DODO_PAYMENTS_API_URL=simulator://.
+The simulator is an httpx transport plugged into the SDK's HTTP client, so
+requests go through the real SDK, admission control and metrics, but never
+leave the process. It implements payments and subscriptions create/retrieve
+and, after each create, posts a signed webhook back to the backend.
+
+Tuning, all optional:
+    DODO_SIMULATOR_LATENCY_MS        mean API latency (default 50)
+    DODO_SIMULATOR_JITTER_MS         uniform +/- jitter on the latency (default 20)
+    DODO_SIMULATOR_ERROR_RATE        fraction of API calls answered with a 500 (default 0)
+    DODO_SIMULATOR_RATE_LIMIT        requests per second before 429s, 0 for none (default 0)
+    DODO_SIMULATOR_FAILURE_RATE      fraction of payments that fail (default 0)
+    DODO_SIMULATOR_WEBHOOK_DELAY_MS  delay before the webhook is sent (default 500)
+    DODO_SIMULATOR_WEBHOOK_URL       webhook target (default the local backend)
+"""
+import os
+import json
+import time
+import uuid
+import hmac
+import base64
+import random
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, Set
+import httpx
+
+from services.rate_limit import TokenBucket
+from services.webhooks import webhook_secrets, signing_key
+
+logger = logging.getLogger(__name__)
+
+SIMULATOR_BASE_URL = "http://dodo-simulator.local"
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class DodoSimulator(httpx.AsyncBaseTransport):
+    """httpx transport answering Dodo API requests from in-memory state"""
+
+    def __init__(self):
+        self.latency = float(os.getenv("DODO_SIMULATOR_LATENCY_MS", "50")) / 1000
+        self.jitter = float(os.getenv("DODO_SIMULATOR_JITTER_MS", "20")) / 1000
+        self.error_rate = float(os.getenv("DODO_SIMULATOR_ERROR_RATE", "0"))
+        self.failure_rate = float(os.getenv("DODO_SIMULATOR_FAILURE_RATE", "0"))
+        self.webhook_delay = float(os.getenv("DODO_SIMULATOR_WEBHOOK_DELAY_MS", "500")) / 1000
+        self.webhook_url = os.getenv(
+            "DODO_SIMULATOR_WEBHOOK_URL", "http://127.0.0.1:8001/api/payments/webhooks/dodo"
+        )
+        rate_limit = float(os.getenv("DODO_SIMULATOR_RATE_LIMIT", "0"))
+        self.rate_limiter = TokenBucket(rate=rate_limit, burst=max(1, int(rate_limit))) if rate_limit > 0 else None
+
+        secrets = webhook_secrets()
+        self._signing_key = signing_key(secrets[0]) if secrets else None
+        if self._signing_key is None:
+            logger.warning("No webhook secret configured, the Dodo simulator will not send webhooks")
+
+        self._payments: Dict[str, Dict[str, Any]] = {}
+        self._subscriptions: Dict[str, Dict[str, Any]] = {}
+        self._webhook_client: Optional[httpx.AsyncClient] = None
+        self._webhook_tasks: Set[asyncio.Task] = set()
+        self._stats = {
+            "requests": 0,
+            "errors_injected": 0,
+            "rate_limited": 0,
+            "webhooks_sent": 0,
+            "webhooks_failed": 0
+        }
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._stats["requests"] += 1
+        if self.rate_limiter is not None and not self.rate_limiter.try_acquire():
+            self._stats["rate_limited"] += 1
+            return self._json(429, {"code": "RATE_LIMITED", "message": "Too many requests"}, {"Retry-After": "1"})
+
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self._stats["errors_injected"] += 1
+            return self._json(500, {"code": "INTERNAL_ERROR", "message": "Simulated failure"})
+
+        parts = request.url.path.strip("/").split("/")
+        body = json.loads(request.content) if request.content else {}
+        if parts == ["payments"] and request.method == "POST":
+            return self._json(200, self._create_payment(body))
+        if parts == ["subscriptions"] and request.method == "POST":
+            return self._json(200, self._create_subscription(body))
+        if len(parts) == 2 and request.method == "GET":
+            store = {"payments": self._payments, "subscriptions": self._subscriptions}.get(parts[0])
+            if store is not None and parts[1] in store:
+                return self._json(200, store[parts[1]])
+        return self._json(404, {"code": "NOT_FOUND", "message": f"No route for {request.method} {request.url.path}"})
+
+    @staticmethod
+    def _json(status_code: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        return httpx.Response(status_code, json=payload, headers=headers)
+
+    def _customer(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        customer = body.get("customer") or {}
+        return {
+            "customer_id": customer.get("customer_id") or f"cus_sim_{uuid.uuid4().hex[:12]}",
+            "email": customer.get("email", "customer@example.com"),
+            "name": customer.get("name", "Simulated Customer")
+        }
+
+    def _create_payment(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        payment_id = f"pay_sim_{uuid.uuid4().hex[:16]}"
+        customer = self._customer(body)
+        total = sum(item.get("amount", 0) * item.get("quantity", 1) for item in body.get("product_cart") or [])
+        # Stored as the SDK's Payment, answered by payments.retrieve
+        self._payments[payment_id] = {
+            "payment_id": payment_id,
+            "status": "processing",
+            "total_amount": total,
+            "currency": body.get("billing_currency", "USD"),
+            "customer": customer,
+            "metadata": body.get("metadata") or {},
+            "product_cart": body.get("product_cart") or [],
+            "created_at": _now()
+        }
+
+        outcome = "failed" if self.failure_rate and random.random() < self.failure_rate else "succeeded"
+        self._schedule(self._settle_payment(payment_id, outcome))
+        # PaymentCreateResponse
+        return {
+            "payment_id": payment_id,
+            "client_secret": f"secret_{payment_id}",
+            "customer": customer,
+            "metadata": body.get("metadata") or {},
+            "total_amount": total,
+            "product_cart": body.get("product_cart") or [],
+            "payment_link": f"{SIMULATOR_BASE_URL}/checkout/{payment_id}" if body.get("payment_link") else None,
+            "expires_on": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+        }
+
+    def _create_subscription(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        subscription_id = f"sub_sim_{uuid.uuid4().hex[:16]}"
+        payment_id = f"pay_sim_{uuid.uuid4().hex[:16]}"
+        customer = self._customer(body)
+        # Stored as the SDK's Subscription, answered by subscriptions.retrieve
+        self._subscriptions[subscription_id] = {
+            "subscription_id": subscription_id,
+            "status": "pending",
+            "product_id": body.get("product_id"),
+            "quantity": body.get("quantity", 1),
+            "customer": customer,
+            "billing": body.get("billing") or {},
+            "metadata": body.get("metadata") or {},
+            "recurring_pre_tax_amount": 0,
+            "addons": [],
+            "created_at": _now()
+        }
+        self._schedule(self._activate_subscription(subscription_id))
+        # SubscriptionCreateResponse
+        return {
+            "subscription_id": subscription_id,
+            "payment_id": payment_id,
+            "product_id": body.get("product_id"),
+            "quantity": body.get("quantity", 1),
+            "client_secret": f"secret_{subscription_id}",
+            "customer": customer,
+            "metadata": body.get("metadata") or {},
+            "recurring_pre_tax_amount": 0,
+            "addons": [],
+            "payment_method_required": True,
+            "payment_link": f"{SIMULATOR_BASE_URL}/checkout/{subscription_id}" if body.get("payment_link") else None,
+            "expires_on": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+        }
+
+    def _schedule(self, coro):
+        task = asyncio.create_task(coro)
+        self._webhook_tasks.add(task)
+        task.add_done_callback(self._webhook_tasks.discard)
+
+    async def _settle_payment(self, payment_id: str, outcome: str):
+        await asyncio.sleep(self.webhook_delay)
+        payment = self._payments[payment_id]
+        payment["status"] = outcome
+        payment["updated_at"] = _now()
+        event_type = "payment.succeeded" if outcome == "succeeded" else "payment.failed"
+        data = {"payment_id": payment_id, "status": outcome, "total_amount": payment["total_amount"]}
+        if outcome == "failed":
+            data["error"] = "Simulated card decline"
+        await self._send_webhook(event_type, data)
+
+    async def _activate_subscription(self, subscription_id: str):
+        await asyncio.sleep(self.webhook_delay)
+        subscription = self._subscriptions[subscription_id]
+        now = datetime.now(timezone.utc)
+        subscription.update({
+            "status": "active",
+            "previous_billing_date": now.isoformat(),
+            "next_billing_date": (now + timedelta(days=30)).isoformat()
+        })
+        await self._send_webhook("subscription.active", {
+            "subscription_id": subscription_id,
+            "status": "active",
+            "previous_billing_date": subscription["previous_billing_date"],
+            "next_billing_date": subscription["next_billing_date"]
+        })
+
+    async def _send_webhook(self, event_type: str, data: Dict[str, Any]):
+        """POST a webhook signed the way Dodo signs them"""
+        if self._signing_key is None:
+            return
+        if self._webhook_client is None:
+            self._webhook_client = httpx.AsyncClient(timeout=10)
+
+        webhook_id = f"msg_sim_{uuid.uuid4().hex}"
+        timestamp = str(int(time.time()))
+        body = json.dumps({
+            "business_id": "bus_simulator",
+            "type": event_type,
+            "timestamp": _now(),
+            "data": data
+        }).encode()
+        digest = hmac.new(self._signing_key, f"{webhook_id}.{timestamp}.".encode() + body, hashlib.sha256).digest()
+        try:
+            response = await self._webhook_client.post(self.webhook_url, content=body, headers={
+                "content-type": "application/json",
+                "webhook-id": webhook_id,
+                "webhook-timestamp": timestamp,
+                "webhook-signature": f"v1,{base64.b64encode(digest).decode()}"
+            })
+            response.raise_for_status()
+            self._stats["webhooks_sent"] += 1
+        except Exception as e:
+            self._stats["webhooks_failed"] += 1
+            logger.error(f"Dodo simulator failed to deliver {event_type} webhook: {str(e)}")
+
+    async def aclose(self):
+        for task in list(self._webhook_tasks):
+            task.cancel()
+        await asyncio.gather(*self._webhook_tasks, return_exceptions=True)
+        if self._webhook_client is not None:
+            await self._webhook_client.aclose()
+            self._webhook_client = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "payments": len(self._payments),
+            "subscriptions": len(self._subscriptions),
+            "webhooks_pending": len(self._webhook_tasks)
+        }
@@ -0,0 +1,73 @@
+"""
+Streaming NDJSON/CSV export of payment documents
+"""
+import io
+import csv
+import json
+import zlib
+from typing import AsyncIterator, Dict, Any, List
+from motor.motor_asyncio import AsyncIOMotorCursor
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+PAYMENT_EXPORT_FIELDS = [
+    "payment_id", "user_id", "customer_id", "amount", "currency",
+    "status", "product_id", "created_at", "updated_at"
+]
+
+def _json_default(value: Any) -> Any:
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+async def _batches(cursor: AsyncIOMotorCursor, batch_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Group cursor documents so each yielded chunk is one network-sized write"""
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def stream_ndjson(cursor: AsyncIOMotorCursor, batch_size: int) -> AsyncIterator[bytes]:
+    async for batch in _batches(cursor, batch_size):
+        lines = [json.dumps(doc, default=_json_default, separators=(",", ":")) for doc in batch]
+        yield ("\n".join(lines) + "\n").encode()
+
+async def stream_csv(
+    cursor: AsyncIOMotorCursor,
+    batch_size: int,
+    fields: List[str] = PAYMENT_EXPORT_FIELDS
+) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    async for batch in _batches(cursor, batch_size):
+        for doc in batch:
+            writer.writerow([_csv_value(doc.get(field)) for field in fields])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Compress a byte stream on the fly into a single gzip member"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
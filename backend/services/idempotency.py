@@ -0,0 +1,165 @@
+"""
+Idempotency-Key handling for payment creation endpoints
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Callable, Awaitable, Optional, Type, TypeVar, Tuple
+from datetime import datetime, timedelta
+from pydantic import BaseModel
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ResponseT = TypeVar("ResponseT", bound=BaseModel)
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+class IdempotencyError(Exception):
+    """Raised when a keyed request cannot be served; carries the HTTP status to return"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def request_fingerprint(request: BaseModel) -> str:
+    """Hash of the request body, used to reject a key reused for a different request"""
+    return hashlib.sha256(request.model_dump_json().encode()).hexdigest()
+
+class IdempotencyStore:
+    """Stores responses by Idempotency-Key and makes duplicate requests wait for the first"""
+
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self.collection = collection
+        self.ttl = timedelta(seconds=int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", str(24 * 3600))))
+        self.lock_timeout = timedelta(seconds=int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT_SECONDS", "60")))
+        self.wait_timeout = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT_SECONDS", "30"))
+        self.poll_interval = 0.1
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    async def run(
+        self,
+        scope: str,
+        key: str,
+        fingerprint: str,
+        response_model: Type[ResponseT],
+        operation: Callable[[], Awaitable[ResponseT]],
+        should_store: Optional[Callable[[ResponseT], bool]] = None
+    ) -> ResponseT:
+        """Run operation once per (scope, key); repeats get the stored response
+
+        Responses for which should_store returns False are handed back but not
+        kept, so the key can be retried.
+        """
+        doc_id = f"{scope}:{key}"
+
+        # Duplicates within this process wait on the first request directly
+        pending = self._inflight.get(doc_id)
+        if pending is not None:
+            if pending[0] != fingerprint:
+                raise IdempotencyError(422, "Idempotency-Key was already used with a different request")
+            try:
+                return await asyncio.shield(pending[1])
+            except asyncio.CancelledError:
+                # The first request was cancelled and released the key; run it ourselves
+                if not pending[1].cancelled() or asyncio.current_task().cancelling():
+                    raise
+            return await self.run(scope, key, fingerprint, response_model, operation, should_store)
+
+        if not await self._acquire(doc_id, fingerprint):
+            return await self._wait_for_response(doc_id, fingerprint, response_model)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[doc_id] = (fingerprint, future)
+        try:
+            response = await operation()
+        except BaseException as e:
+            try:
+                await self._release(doc_id)
+            finally:
+                # Waiters must be released even if the request is cancelled mid-cleanup
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                    future.exception()
+                else:
+                    future.cancel()
+                del self._inflight[doc_id]
+            raise
+        future.set_result(response)
+        del self._inflight[doc_id]
+
+        if should_store is not None and not should_store(response):
+            await self._release(doc_id)
+        else:
+            await self._complete(doc_id, response)
+        return response
+
+    async def _complete(self, doc_id: str, response: BaseModel):
+        """Store the response; shielded so a cancelled request still records it"""
+        now = datetime.utcnow()
+        try:
+            await asyncio.shield(self.collection.update_one(
+                {"_id": doc_id},
+                {"$set": {
+                    "status": COMPLETED,
+                    "response": response.model_dump(),
+                    "completed_at": now,
+                    "expires_at": now + self.ttl
+                }}
+            ))
+        except Exception as e:
+            # The operation already succeeded, so its response is returned regardless
+            logger.error(f"Failed to store idempotent response for {doc_id}: {str(e)}")
+
+    async def _release(self, doc_id: str):
+        """Drop an unfinished claim so the key can be retried"""
+        try:
+            await asyncio.shield(self.collection.delete_one({"_id": doc_id, "status": IN_PROGRESS}))
+        except Exception as e:
+            logger.error(f"Failed to release idempotency key {doc_id}: {str(e)}")
+
+    async def _acquire(self, doc_id: str, fingerprint: str) -> bool:
+        """Claim the key; returns False if another request already holds it"""
+        now = datetime.utcnow()
+        doc = {
+            "_id": doc_id,
+            "status": IN_PROGRESS,
+            "fingerprint": fingerprint,
+            "created_at": now,
+            "expires_at": now + self.ttl
+        }
+        try:
+            await self.collection.insert_one(doc)
+            return True
+        except DuplicateKeyError:
+            pass
+
+        # Take over a claim abandoned by a crashed worker
+        result = await self.collection.replace_one(
+            {"_id": doc_id, "status": IN_PROGRESS, "created_at": {"$lt": now - self.lock_timeout}},
+            doc
+        )
+        return result.modified_count > 0
+
+    async def _wait_for_response(
+        self,
+        doc_id: str,
+        fingerprint: str,
+        response_model: Type[ResponseT]
+    ) -> ResponseT:
+        deadline = asyncio.get_running_loop().time() + self.wait_timeout
+        while True:
+            existing = await self.collection.find_one({"_id": doc_id})
+            if existing is None:
+                raise IdempotencyError(409, "The original request for this Idempotency-Key failed; retry it")
+            if existing.get("fingerprint") != fingerprint:
+                raise IdempotencyError(422, "Idempotency-Key was already used with a different request")
+            if existing["status"] == COMPLETED:
+                return response_model(**existing["response"])
+            if asyncio.get_running_loop().time() >= deadline:
+                raise IdempotencyError(409, "A request with this Idempotency-Key is still in progress")
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,41 @@
+"""
+Mongo-backed leases so only one worker process runs a singleton job
+"""
+import os
+import socket
+import logging
+from datetime import datetime, timedelta
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+class Lease:
+    """A named, time-limited lock held by one process at a time"""
+
+    def __init__(self, collection: AsyncIOMotorCollection, name: str, ttl_seconds: float):
+        self.collection = collection
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def acquire(self) -> bool:
+        """Take or renew the lease; returns False if another holder still owns it"""
+        now = datetime.utcnow()
+        try:
+            await self.collection.find_one_and_update(
+                {
+                    "_id": self.name,
+                    "$or": [{"holder": self.holder}, {"expires_at": {"$lt": now}}]
+                },
+                {"$set": {"holder": self.holder, "expires_at": now + self.ttl, "acquired_at": now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The upsert collided with a live lease owned by someone else
+            return False
+        return True
+
+    async def release(self):
+        """Give the lease up early if this process holds it"""
+        await self.collection.delete_one({"_id": self.name, "holder": self.holder})
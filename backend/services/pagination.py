@@ -0,0 +1,64 @@
+"""
+Keyset pagination helpers over (created_at, _id)
+"""
+import json
+import base64
+from typing import Optional, Dict, Any, Tuple
+from datetime import datetime
+
+# Newest first; both fields descending so the compound indexes serve the sort
+KEYSET_SORT = [("created_at", -1), ("_id", -1)]
+
+def encode_cursor(created_at: datetime, doc_id: Any) -> str:
+    """Encode the position after a document as an opaque cursor"""
+    raw = json.dumps({"c": created_at.isoformat(), "i": doc_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, Any]:
+    """Decode a cursor produced by encode_cursor; raises ValueError if malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(data["c"]), data["i"]
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+def keyset_query(
+    filters: Dict[str, Any],
+    cursor: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Build a query for the page that starts after the cursor position"""
+    query = {key: value for key, value in filters.items() if value is not None}
+
+    created_range = {}
+    if created_after:
+        created_range["$gte"] = created_after
+    if created_before:
+        created_range["$lt"] = created_before
+    if created_range:
+        query["created_at"] = created_range
+
+    if cursor:
+        created_at, doc_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": doc_id}}
+        ]
+    return query
+
+# Bookkeeping fields written by background jobs, never returned to clients
+INTERNAL_FIELDS = ("rolled_up", "outcome_at", "reconcile_checked_at", "reconcile_next_check_at")
+
+def projection_for(fields: Optional[str], include_metadata: bool) -> Dict[str, int]:
+    """Projection from a comma-separated field list, or one that drops internal fields and metadata"""
+    if fields:
+        projection = {field.strip(): 1 for field in fields.split(",") if field.strip()}
+        # The keyset fields are always needed to build the next cursor
+        projection.update({"_id": 1, "created_at": 1})
+        return projection
+    projection = {field: 0 for field in INTERNAL_FIELDS}
+    if not include_metadata:
+        projection["metadata"] = 0
+    return projection
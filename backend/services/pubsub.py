@@ -0,0 +1,98 @@
+"""
+In-process pub/sub fan-out for payment and subscription status changes
+"""
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, Optional, Set, Tuple
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+logger = logging.getLogger(__name__)
+
+# Topics are (kind, id), e.g. ("payment", "pay_123")
+Topic = Tuple[str, str]
+
+class StatusBroker:
+    """Delivers each published message to every listener of its topic"""
+
+    def __init__(self, queue_size: int = 16):
+        self.queue_size = queue_size
+        self._subscribers: Dict[Topic, Set[asyncio.Queue]] = {}
+        self.published = 0
+
+    @contextmanager
+    def subscribe(self, topic: Topic) -> Iterator[asyncio.Queue]:
+        """Register a listener queue for the duration of the with-block"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(topic, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            listeners = self._subscribers.get(topic)
+            if listeners is not None:
+                listeners.discard(queue)
+                if not listeners:
+                    del self._subscribers[topic]
+
+    def publish(self, topic: Topic, message: Dict[str, Any]):
+        """Fan a message out without blocking; slow listeners lose their oldest message"""
+        listeners = self._subscribers.get(topic)
+        if not listeners:
+            return
+        self.published += 1
+        for queue in listeners:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "topics": len(self._subscribers),
+            "listeners": sum(len(listeners) for listeners in self._subscribers.values()),
+            "published": self.published
+        }
+
+async def relay_change_stream(
+    collection: AsyncIOMotorCollection,
+    broker: StatusBroker,
+    kind: str,
+    key_field: str,
+    on_change: Optional[Callable[[str, str, Dict[str, Any]], None]] = None
+):
+    """Publish status changes written by any worker, as seen by a MongoDB change stream
+
+    on_change, if given, is called with (kind, id, document) for every change,
+    e.g. to drop cache entries another worker's write made stale.
+    """
+    pipeline = [
+        {"$match": {
+            "operationType": {"$in": ["insert", "update", "replace"]},
+            "$or": [
+                {"operationType": {"$ne": "update"}},
+                {"updateDescription.updatedFields.status": {"$exists": True}}
+            ]
+        }},
+        {"$project": {
+            f"fullDocument.{key_field}": 1,
+            "fullDocument.status": 1,
+            "fullDocument.updated_at": 1,
+            "fullDocument.user_id": 1
+        }}
+    ]
+    while True:
+        try:
+            async with collection.watch(pipeline, full_document="updateLookup") as stream:
+                async for change in stream:
+                    doc = change.get("fullDocument") or {}
+                    if doc.get(key_field):
+                        if on_change is not None:
+                            on_change(kind, doc[key_field], doc)
+                        broker.publish((kind, doc[key_field]), {
+                            "status": doc.get("status"),
+                            "updated_at": doc.get("updated_at")
+                        })
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Change stream on {collection.name} failed, restarting: {str(e)}")
+            await asyncio.sleep(5)
@@ -0,0 +1,155 @@
+"""
+Background reconciliation of payments stuck in PENDING
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any
+from datetime import datetime, timedelta
+
+from models.payment import PaymentStatus
+from services.dodo_payments import DodoPaymentsService
+from services.lease import Lease
+from services.rate_limit import TokenBucket
+from metrics import RECONCILER_CHECKED, RECONCILER_CORRECTED, RECONCILER_ERRORS, RECONCILER_LAG
+
+logger = logging.getLogger(__name__)
+
+# Lookup result for payments the Dodo API does not know about
+NOT_FOUND = object()
+
+class PaymentReconciler:
+    """Periodically asks Dodo for the real state of stale pending payments"""
+
+    def __init__(self, dodo_service: DodoPaymentsService, lease: Lease):
+        self.dodo_service = dodo_service
+        self.lease = lease
+        self.interval = float(os.getenv("RECONCILER_INTERVAL_SECONDS", "300"))
+        self.pending_age = timedelta(seconds=int(os.getenv("RECONCILER_PENDING_AGE_SECONDS", "3600")))
+        self.batch_size = int(os.getenv("RECONCILER_BATCH_SIZE", "200"))
+        # Payments Dodo still reports as pending are re-checked after this long
+        self.recheck_interval = timedelta(seconds=int(os.getenv("RECONCILER_RECHECK_SECONDS", str(6 * 3600))))
+        # Checkouts still pending after this long are treated as abandoned and canceled
+        self.max_pending_age = timedelta(seconds=int(os.getenv("RECONCILER_MAX_PENDING_AGE_SECONDS", str(7 * 24 * 3600))))
+        self.concurrency = int(os.getenv("RECONCILER_CONCURRENCY", "5"))
+        self.rate_limiter = TokenBucket(
+            rate=float(os.getenv("RECONCILER_RATE_PER_SECOND", "10")),
+            burst=self.concurrency
+        )
+
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "runs": 0,
+            "checked": 0,
+            "corrected": 0,
+            "abandoned": 0,
+            "errors": 0,
+            "is_leader": False,
+            "last_run_at": None,
+            "last_run_seconds": None,
+            "oldest_pending_age_seconds": None
+        }
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"Payment reconciler started (interval={self.interval}s)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.lease.release()
+
+    async def _loop(self):
+        while True:
+            try:
+                # Hold the lease for longer than one interval so the leader keeps it between runs
+                self._stats["is_leader"] = await self.lease.acquire()
+                if self._stats["is_leader"]:
+                    await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                RECONCILER_ERRORS.inc()
+                logger.error(f"Error reconciling pending payments: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """Reconcile one batch of stale pending payments; returns the number corrected"""
+        started_at = time.monotonic()
+        collection = self.dodo_service.payments_collection
+        now = datetime.utcnow()
+        cutoff = now - self.pending_age
+
+        # Never-checked payments sort first, then the longest unchecked, so payments
+        # that stay pending rotate out of the batch instead of starving newer ones
+        pending = await collection.find(
+            {
+                "status": PaymentStatus.PENDING,
+                "created_at": {"$lt": cutoff},
+                "reconcile_next_check_at": {"$not": {"$gt": now}}
+            },
+            {"payment_id": 1, "created_at": 1}
+        ).sort([("reconcile_next_check_at", 1), ("created_at", 1)]).limit(self.batch_size).to_list(self.batch_size)
+
+        oldest = await collection.find_one(
+            {"status": PaymentStatus.PENDING, "created_at": {"$lt": cutoff}},
+            {"created_at": 1},
+            sort=[("created_at", 1)]
+        )
+        lag = (now - oldest["created_at"]).total_seconds() if oldest else 0.0
+        self._stats["oldest_pending_age_seconds"] = lag
+        RECONCILER_LAG.set(lag)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(payment_id: str) -> Any:
+            async with semaphore:
+                await self.rate_limiter.acquire()
+                try:
+                    return await self.dodo_service.fetch_payment_status(payment_id)
+                except Exception as e:
+                    if getattr(e, "status_code", None) == 404:
+                        # Dodo has no such payment, so the checkout can never complete
+                        return NOT_FOUND
+                    self._stats["errors"] += 1
+                    RECONCILER_ERRORS.inc()
+                    logger.error(f"Error fetching payment {payment_id} from Dodo: {str(e)}")
+                    return None
+
+        statuses = await asyncio.gather(*[check(doc["payment_id"]) for doc in pending])
+        abandoned_before = now - self.max_pending_age
+        corrections: Dict[str, PaymentStatus] = {}
+        for doc, payment_status in zip(pending, statuses):
+            if payment_status is NOT_FOUND or (
+                payment_status == PaymentStatus.PENDING and doc["created_at"] < abandoned_before
+            ):
+                corrections[doc["payment_id"]] = PaymentStatus.CANCELED
+                self._stats["abandoned"] += 1
+            elif payment_status is not None and payment_status != PaymentStatus.PENDING:
+                corrections[doc["payment_id"]] = payment_status
+
+        # Push everything checked (including failed lookups) to the back of the queue
+        if pending:
+            await collection.update_many(
+                {"payment_id": {"$in": [doc["payment_id"] for doc in pending]}},
+                {"$set": {"reconcile_checked_at": now, "reconcile_next_check_at": now + self.recheck_interval}}
+            )
+        corrected = await self.dodo_service.apply_payment_corrections(corrections)
+
+        self._stats["runs"] += 1
+        self._stats["checked"] += len(pending)
+        self._stats["corrected"] += corrected
+        self._stats["last_run_at"] = datetime.utcnow().isoformat()
+        self._stats["last_run_seconds"] = round(time.monotonic() - started_at, 3)
+        RECONCILER_CHECKED.inc(len(pending))
+        RECONCILER_CORRECTED.inc(corrected)
+        if pending:
+            logger.info(f"Reconciled {len(pending)} pending payments, corrected {corrected}")
+        return corrected
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self._stats)
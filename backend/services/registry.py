@@ -0,0 +1,205 @@
+"""
+Application-scoped service registry for Dodo Payments
+"""
+import os
+import asyncio
+import logging
+import importlib
+from typing import Optional, Dict, Any, List, Callable, Awaitable, TYPE_CHECKING
+
+from models.payment import WebhookEvent
+from services.dodo_payments import DodoPaymentsService, simulator_enabled
+from services.webhook_queue import WebhookWorkerPool
+from services.reconciler import PaymentReconciler
+from services.lease import Lease
+from services.pubsub import relay_change_stream
+from database import get_database_collections
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# Global service instance shared by every request in this process
+_dodo_service: Optional[DodoPaymentsService] = None
+_http_client: Optional["httpx.AsyncClient"] = None
+_limits: Optional["httpx.Limits"] = None
+_webhook_pool: Optional[WebhookWorkerPool] = None
+_reconciler: Optional[PaymentReconciler] = None
+_status_relays: List[asyncio.Task] = []
+_simulator = None
+_init_lock = asyncio.Lock()
+
+class ConnectionPoolStats:
+    """Counts outbound requests and new connections on the shared HTTP pool"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+
+    async def trace(self, event_name: str, info: Dict[str, Any]):
+        """httpcore trace callback, invoked for every connection-level event"""
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    async def on_request(self, request: "httpx.Request"):
+        """httpx request hook that attaches the trace callback"""
+        self.requests += 1
+        request.extensions["trace"] = self.trace
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connections_reused": max(self.requests - self.connections_opened, 0),
+        }
+
+_pool_stats = ConnectionPoolStats()
+
+def _pool_limits() -> "httpx.Limits":
+    """Read connection pool limits from the environment"""
+    import httpx
+    return httpx.Limits(
+        max_connections=int(os.getenv("DODO_PAYMENTS_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("DODO_PAYMENTS_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        keepalive_expiry=float(os.getenv("DODO_PAYMENTS_KEEPALIVE_EXPIRY", "30")),
+    )
+
+async def init_dodo_service() -> DodoPaymentsService:
+    """Build the shared Dodo Payments service and its HTTP connection pool"""
+    global _dodo_service, _http_client, _limits, _simulator
+    async with _init_lock:
+        if _dodo_service is not None:
+            return _dodo_service
+
+        # Import the SDK (and httpx) in a thread on first use so the event loop
+        # keeps serving other startup work, such as index creation, meanwhile
+        await asyncio.to_thread(importlib.import_module, "dodopayments")
+        from dodopayments import DefaultAsyncHttpxClient
+
+        client_kwargs = {}
+        if simulator_enabled():
+            from services.dodo_simulator import DodoSimulator
+            _simulator = DodoSimulator()
+            client_kwargs["transport"] = _simulator
+            logger.info("Serving Dodo Payments API calls from the in-process simulator")
+        
+        limits = _pool_limits()
+        http_client = DefaultAsyncHttpxClient(
+            limits=limits,
+            event_hooks={"request": [_pool_stats.on_request]},
+            **client_kwargs
+        )
+        try:
+            collections = await get_database_collections()
+            _dodo_service = DodoPaymentsService(collections, http_client=http_client)
+        except Exception:
+            await http_client.aclose()
+            raise
+
+        _http_client = http_client
+        _limits = limits
+        logger.info(
+            f"Dodo Payments client initialized (max_connections={limits.max_connections}, "
+            f"max_keepalive_connections={limits.max_keepalive_connections})"
+        )
+        return _dodo_service
+
+async def get_dodo_service() -> DodoPaymentsService:
+    """Dependency to get the shared Dodo Payments service"""
+    if _dodo_service is not None:
+        return _dodo_service
+    return await init_dodo_service()
+
+def dodo_service_ready() -> bool:
+    """Whether the Dodo Payments client has been initialized"""
+    return _dodo_service is not None
+
+def webhook_processing_mode() -> str:
+    """Either "sync" (process before acknowledging) or "async" (inbox + workers)"""
+    return os.getenv("WEBHOOK_PROCESSING_MODE", "sync").lower()
+
+async def start_webhook_worker_pool(
+    processor: Callable[[WebhookEvent], Awaitable[None]]
+) -> WebhookWorkerPool:
+    """Start the background webhook workers for this process"""
+    global _webhook_pool
+    if _webhook_pool is None:
+        collections = await get_database_collections()
+        _webhook_pool = WebhookWorkerPool(collections["webhook_events"], processor)
+        await _webhook_pool.start()
+    return _webhook_pool
+
+def get_webhook_worker_pool() -> Optional[WebhookWorkerPool]:
+    """The running webhook worker pool, if async processing is enabled"""
+    return _webhook_pool
+
+def reconciler_enabled() -> bool:
+    return os.getenv("RECONCILER_ENABLED", "false").lower() in ("1", "true", "yes")
+
+async def start_payment_reconciler(dodo_service: DodoPaymentsService) -> PaymentReconciler:
+    """Start the pending-payment reconciler; only the lease holder across workers runs it"""
+    global _reconciler
+    if _reconciler is None:
+        collections = await get_database_collections()
+        interval = float(os.getenv("RECONCILER_INTERVAL_SECONDS", "300"))
+        lease = Lease(collections["leases"], "payment_reconciler", ttl_seconds=interval * 2)
+        _reconciler = PaymentReconciler(dodo_service, lease)
+        await _reconciler.start()
+    return _reconciler
+
+def get_payment_reconciler() -> Optional[PaymentReconciler]:
+    return _reconciler
+
+async def start_status_relays(dodo_service: DodoPaymentsService):
+    """Feed status streams and cache invalidation from MongoDB change streams so every worker sees every write"""
+    if dodo_service.status_events_source != "change_stream" or _status_relays:
+        return
+    _status_relays.extend([
+        asyncio.create_task(relay_change_stream(
+            dodo_service.payments_collection, dodo_service.status_broker, "payment", "payment_id",
+            dodo_service.invalidate_cached
+        )),
+        asyncio.create_task(relay_change_stream(
+            dodo_service.subscriptions_collection, dodo_service.status_broker, "subscription", "subscription_id",
+            dodo_service.invalidate_cached
+        ))
+    ])
+
+async def close_dodo_service():
+    """Close the shared Dodo Payments client, its connection pool and background workers"""
+    global _dodo_service, _http_client, _webhook_pool, _reconciler, _simulator
+    if _reconciler is not None:
+        await _reconciler.stop()
+    _reconciler = None
+    for task in _status_relays:
+        task.cancel()
+    await asyncio.gather(*_status_relays, return_exceptions=True)
+    _status_relays.clear()
+    if _webhook_pool is not None:
+        await _webhook_pool.stop()
+    _webhook_pool = None
+    if _dodo_service is not None:
+        await _dodo_service.close()
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _dodo_service = None
+    _simulator = None
+
+def get_simulator_stats() -> Optional[Dict[str, Any]]:
+    return _simulator.get_stats() if _simulator is not None else None
+
+def get_client_pool_stats() -> Dict[str, Any]:
+    """Connection pool configuration and reuse counters for the Dodo client"""
+    stats = {"initialized": _dodo_service is not None}
+    if _http_client is not None:
+        pool = getattr(_http_client._transport, "_pool", None)
+        stats.update({
+            "max_connections": _limits.max_connections,
+            "max_keepalive_connections": _limits.max_keepalive_connections,
+            "keepalive_expiry": _limits.keepalive_expiry,
+            "open_connections": len(pool.connections) if pool is not None else None,
+        })
+    stats.update(_pool_stats.snapshot())
+    return stats
@@ -0,0 +1,101 @@
+"""
+Registry-based dispatch of webhook events to async handlers
+"""
+import time
+import asyncio
+import logging
+from typing import Dict, Any, List, Set, Callable, Awaitable, Optional, Tuple
+
+from models.payment import WebhookEvent
+from services.dodo_payments import DodoPaymentsService
+from services.stats import LatencyStats
+from metrics import WEBHOOK_HANDLER_LATENCY, WEBHOOK_HANDLER_ERRORS
+
+logger = logging.getLogger(__name__)
+
+WebhookHandler = Callable[[Dict[str, Any], DodoPaymentsService], Awaitable[None]]
+
+class WebhookDispatcher:
+    """Maps event types to handlers and runs the handlers of an event concurrently
+
+    Critical handlers are awaited and their failures fail the delivery so it is
+    retried. Side-effect handlers run in the background after dispatch returns;
+    their failures are logged and counted but never retried.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Tuple[WebhookHandler, bool]]] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._latency: Dict[str, LatencyStats] = {}
+        self._errors: Dict[str, int] = {}
+        self.unhandled = 0
+
+    def on(self, *event_types: str, critical: bool = True) -> Callable[[WebhookHandler], WebhookHandler]:
+        """Decorator registering a handler for one or more event types"""
+        def decorator(handler: WebhookHandler) -> WebhookHandler:
+            for event_type in event_types:
+                self.register(event_type, handler, critical=critical)
+            return handler
+        return decorator
+
+    def register(self, event_type: str, handler: WebhookHandler, critical: bool = True):
+        self._handlers.setdefault(event_type, []).append((handler, critical))
+
+    async def dispatch(self, event: WebhookEvent, dodo_service: DodoPaymentsService):
+        """Run every handler registered for the event's type"""
+        handlers = self._handlers.get(event.type)
+        if not handlers:
+            self.unhandled += 1
+            logger.warning(f"Unhandled webhook event type: {event.type}")
+            return
+
+        for handler, critical in handlers:
+            if not critical:
+                task = asyncio.create_task(self._run(handler, event, dodo_service))
+                self._background.add(task)
+                task.add_done_callback(self._background_done)
+
+        results = await asyncio.gather(
+            *[self._run(handler, event, dodo_service) for handler, critical in handlers if critical],
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _run(self, handler: WebhookHandler, event: WebhookEvent, dodo_service: DodoPaymentsService):
+        name = handler.__name__
+        started_at = time.perf_counter()
+        try:
+            await handler(event.data, dodo_service)
+        except Exception as e:
+            self._errors[name] = self._errors.get(name, 0) + 1
+            WEBHOOK_HANDLER_ERRORS.labels(event.type, name).inc()
+            logger.error(f"Webhook handler {name} failed for {event.type}: {str(e)}")
+            raise
+        finally:
+            elapsed = time.perf_counter() - started_at
+            self._latency.setdefault(name, LatencyStats()).observe(elapsed)
+            WEBHOOK_HANDLER_LATENCY.labels(event.type, name).observe(elapsed)
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled():
+            # Already logged and counted in _run
+            task.exception()
+
+    async def drain(self, timeout: Optional[float] = 10.0):
+        """Wait for background handlers to finish, e.g. during shutdown"""
+        if self._background:
+            await asyncio.wait(list(self._background), timeout=timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "event_types": sorted(self._handlers),
+            "unhandled": self.unhandled,
+            "background_in_flight": len(self._background),
+            "handlers": {
+                name: {**stats.snapshot(), "errors": self._errors.get(name, 0)}
+                for name, stats in self._latency.items()
+            }
+        }
@@ -0,0 +1,226 @@
+"""
+Durable webhook inbox drained by a pool of async workers
+"""
+import os
+import time
+import zlib
+import asyncio
+import logging
+from typing import Optional, Dict, Any, Callable, Awaitable, List, Set
+from datetime import datetime, timedelta
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from models.payment import WebhookEvent
+from services.stats import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Inbox states for documents in the webhook_events collection
+PENDING = "pending"
+RETRY = "retry"
+PROCESSING = "processing"
+PROCESSED = "processed"
+DEAD = "dead"
+
+def ordering_key(event_id: str, data: Dict[str, Any]) -> str:
+    """Events for the same subscription or payment are processed in arrival order"""
+    if data.get("subscription_id"):
+        return f"subscription:{data['subscription_id']}"
+    if data.get("payment_id"):
+        return f"payment:{data['payment_id']}"
+    return f"event:{event_id}"
+
+class WebhookWorkerPool:
+    """Processes inbox events in the background with per-key ordering and retries"""
+
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        processor: Callable[[WebhookEvent], Awaitable[None]],
+        workers: Optional[int] = None
+    ):
+        self.collection = collection
+        self.processor = processor
+        self.workers = workers or int(os.getenv("WEBHOOK_WORKERS", "4"))
+        self.max_attempts = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+        self.retry_base_delay = float(os.getenv("WEBHOOK_RETRY_BASE_DELAY", "2"))
+        self.retry_max_delay = float(os.getenv("WEBHOOK_RETRY_MAX_DELAY", "600"))
+        self.poll_interval = float(os.getenv("WEBHOOK_POLL_INTERVAL", "5"))
+        self.lease = timedelta(seconds=int(os.getenv("WEBHOOK_LEASE_SECONDS", "60")))
+        self.event_ttl = timedelta(
+            seconds=int(os.getenv("WEBHOOK_EVENT_TTL_SECONDS", str(7 * 24 * 3600)))
+        )
+
+        self._queues: List[asyncio.Queue] = []
+        self._queued: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._started_at: Optional[float] = None
+        self._busy_seconds = 0.0
+        self._lag = LatencyStats()
+        self._counts = {"processed": 0, "retried": 0, "dead": 0, "deferred": 0}
+
+    async def start(self):
+        """Start the worker and poller tasks"""
+        self._started_at = time.monotonic()
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+        self._tasks.append(asyncio.create_task(self._poller()))
+        logger.info(f"Webhook worker pool started with {self.workers} workers")
+
+    async def stop(self):
+        """Stop all tasks; unfinished events are picked up again after their lease"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, event_id: str, event_data: Dict[str, Any]) -> bool:
+        """Store an event in the inbox and queue it; returns False for duplicates"""
+        now = datetime.utcnow()
+        key = ordering_key(event_id, event_data.get("data") or {})
+        try:
+            await self.collection.insert_one({
+                "event_id": event_id,
+                "type": event_data.get("type"),
+                "status": PENDING,
+                "ordering_key": key,
+                "payload": event_data,
+                "attempts": 0,
+                "received_at": now,
+                "next_attempt_at": now,
+                "created_at": now
+            })
+        except DuplicateKeyError:
+            return False
+
+        self._enqueue(event_id, key)
+        return True
+
+    def _enqueue(self, event_id: str, key: str):
+        if event_id in self._queued or not self._queues:
+            return
+        self._queued.add(event_id)
+        self._queues[zlib.crc32(key.encode()) % len(self._queues)].put_nowait(event_id)
+
+    async def _poller(self):
+        """Pick up due retries and events left behind by other or crashed workers"""
+        while True:
+            try:
+                now = datetime.utcnow()
+                cursor = self.collection.find(
+                    {"$or": [
+                        {"status": {"$in": [PENDING, RETRY]}, "next_attempt_at": {"$lte": now}},
+                        {"status": PROCESSING, "lease_until": {"$lt": now}}
+                    ]},
+                    {"event_id": 1, "ordering_key": 1}
+                ).sort("received_at", 1).limit(500)
+                async for doc in cursor:
+                    self._enqueue(doc["event_id"], doc["ordering_key"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error polling webhook inbox: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            event_id = await queue.get()
+            started_at = time.monotonic()
+            try:
+                await self._handle(event_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error handling webhook event {event_id}: {str(e)}")
+            finally:
+                self._queued.discard(event_id)
+                self._busy_seconds += time.monotonic() - started_at
+
+    async def _claim(self, event_id: str) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {
+                "event_id": event_id,
+                "$or": [
+                    {"status": {"$in": [PENDING, RETRY]}, "next_attempt_at": {"$lte": now}},
+                    {"status": PROCESSING, "lease_until": {"$lt": now}}
+                ]
+            },
+            {"$set": {"status": PROCESSING, "lease_until": now + self.lease}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _handle(self, event_id: str):
+        doc = await self._claim(event_id)
+        if doc is None:
+            return
+
+        # Earlier events for the same subscription/payment must finish first
+        predecessor = await self.collection.find_one(
+            {
+                "ordering_key": doc["ordering_key"],
+                "status": {"$in": [PENDING, RETRY, PROCESSING]},
+                "received_at": {"$lt": doc["received_at"]}
+            },
+            {"_id": 1}
+        )
+        if predecessor is not None:
+            self._counts["deferred"] += 1
+            await self.collection.update_one(
+                {"event_id": event_id},
+                {"$set": {"status": PENDING, "next_attempt_at": datetime.utcnow() + timedelta(seconds=1)}}
+            )
+            return
+
+        try:
+            await self.processor(WebhookEvent(**doc["payload"]))
+        except Exception as e:
+            await self._fail(doc, e)
+            return
+
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {"event_id": event_id},
+            {
+                "$set": {"status": PROCESSED, "processed_at": now, "expires_at": now + self.event_ttl},
+                "$unset": {"lease_until": "", "next_attempt_at": ""}
+            }
+        )
+        self._counts["processed"] += 1
+        self._lag.observe((now - doc["received_at"]).total_seconds())
+
+    async def _fail(self, doc: Dict[str, Any], error: Exception):
+        attempts = doc.get("attempts", 0) + 1
+        update = {"attempts": attempts, "last_error": str(error)}
+        if attempts >= self.max_attempts:
+            update["status"] = DEAD
+            self._counts["dead"] += 1
+            logger.error(f"Webhook event {doc['event_id']} moved to dead-letter after {attempts} attempts: {str(error)}")
+        else:
+            delay = min(self.retry_base_delay * 2 ** (attempts - 1), self.retry_max_delay)
+            update["status"] = RETRY
+            update["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=delay)
+            self._counts["retried"] += 1
+            logger.warning(f"Webhook event {doc['event_id']} failed (attempt {attempts}), retrying in {delay}s: {str(error)}")
+
+        await self.collection.update_one(
+            {"event_id": doc["event_id"]},
+            {"$set": update, "$unset": {"lease_until": ""}}
+        )
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Queue depth, processing lag and worker utilization"""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        backlog = {}
+        for state in (PENDING, RETRY, PROCESSING, DEAD):
+            backlog[state] = await self.collection.count_documents({"status": state})
+        return {
+            "workers": self.workers,
+            "queue_depth": sum(queue.qsize() for queue in self._queues),
+            "inbox": backlog,
+            "processing_lag": self._lag.snapshot(),
+            "utilization": round(self._busy_seconds / (elapsed * self.workers), 4) if elapsed else 0.0,
+            **self._counts
+        }
@@ -0,0 +1,99 @@
+"""
+Write-behind batcher that coalesces single-document updates into bulk_write calls
+"""
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+class BulkWriteBatcher:
+    """Collects $set updates keyed by a unique field and flushes them as one unordered bulk_write"""
+
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        key_field: str,
+        max_batch: int = 500,
+        max_delay: float = 0.005
+    ):
+        self.collection = collection
+        self.key_field = key_field
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        # Pending updates per key: merged $set document plus the futures waiting on it
+        self._pending: Dict[str, Tuple[Dict[str, Any], List[asyncio.Future]]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+        self.batches = 0
+        self.operations = 0
+
+    def submit(self, key: str, set_fields: Dict[str, Any]) -> asyncio.Future:
+        """Queue a $set for the document with key_field == key; resolves to True once written"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        if key in self._pending:
+            # Later updates to the same document win, preserving arrival order
+            self._pending[key][0].update(set_fields)
+            self._pending[key][1].append(future)
+        else:
+            self._pending[key] = (dict(set_fields), [future])
+
+        if len(self._pending) >= self.max_batch:
+            self._schedule_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_delay, self._schedule_flush)
+        return future
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: Dict[str, Tuple[Dict[str, Any], List[asyncio.Future]]]):
+        keys = list(batch.keys())
+        requests = [UpdateOne({self.key_field: key}, {"$set": batch[key][0]}) for key in keys]
+        failed: Dict[int, Exception] = {}
+        try:
+            await self.collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = Exception(error.get("errmsg", "bulk write error"))
+        except Exception as e:
+            failed = {index: e for index in range(len(keys))}
+
+        self.batches += 1
+        self.operations += len(keys)
+        for index, key in enumerate(keys):
+            for future in batch[key][1]:
+                if future.done():
+                    continue
+                if index in failed:
+                    future.set_exception(failed[index])
+                else:
+                    future.set_result(True)
+
+    async def flush(self):
+        """Write everything still pending and wait for in-flight batches"""
+        self._schedule_flush()
+        if self._flushes:
+            await asyncio.gather(*list(self._flushes), return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "operations": self.operations,
+            "avg_batch_size": round(self.operations / self.batches, 2) if self.batches else 0.0
+        }
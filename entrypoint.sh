@@ -4,25 +4,53 @@ set -e
 # Start the FastAPI backend
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
-echo "Starting FastAPI backend"
-# Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
+# BACKEND_SERVER=uvicorn runs a single process instead of gunicorn workers
+if [ "${BACKEND_SERVER:-gunicorn}" = "gunicorn" ]; then
+    echo "Starting FastAPI backend with gunicorn workers"
+    gunicorn -c gunicorn.conf.py server:app &
+    # SIGHUP makes the gunicorn master replace its workers gracefully
+    RELOAD_ON_HUP=1
+else
+    echo "Starting FastAPI backend"
+    # Start Uvicorn with proper host binding
+    uvicorn server:app --host 0.0.0.0 --port 8001 &
+fi
 BACKEND_PID=$!
 
-echo "Waiting for backend to start..."
-sleep 30
+# Wait until the backend reports ready (MongoDB reachable, indexes built,
+# Dodo client initialized) instead of sleeping for a fixed time
+READY_URL="http://127.0.0.1:8001/api/health/ready"
+STARTUP_TIMEOUT=${BACKEND_STARTUP_TIMEOUT:-120}
+WAITED=0
 
-if ! kill -0 $BACKEND_PID 2>/dev/null; then
-    echo "Backend failed to start at initialization, exiting"
-    exit 1
-fi
+echo "Waiting for backend to become ready..."
+until wget -q -T 2 -O /dev/null "$READY_URL" 2>/dev/null; do
+    if ! kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "Backend failed to start at initialization, exiting"
+        exit 1
+    fi
+    if [ "$WAITED" -ge "$STARTUP_TIMEOUT" ]; then
+        echo "Backend not ready after ${STARTUP_TIMEOUT}s, exiting"
+        kill $BACKEND_PID
+        exit 1
+    fi
+    sleep 1
+    WAITED=$((WAITED + 1))
+done
+echo "Backend ready after ~${WAITED}s"
 
 # Start Nginx
 nginx -g 'daemon off;' &
 NGINX_PID=$!
 
-# Handle termination signals
+# Handle termination signals; SIGHUP gracefully reloads gunicorn workers and is
+# ignored under uvicorn, which would exit on it
 trap 'kill $BACKEND_PID $NGINX_PID; exit 0' SIGTERM SIGINT
+if [ -n "$RELOAD_ON_HUP" ]; then
+    trap 'kill -HUP $BACKEND_PID' SIGHUP
+else
+    trap '' SIGHUP
+fi
 
 # Check if processes are still running
 while kill -0 $BACKEND_PID 2>/dev/null && kill -0 $NGINX_PID 2>/dev/null; do
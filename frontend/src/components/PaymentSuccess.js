@@ -1,9 +1,13 @@
 import React, { useEffect, useState } from 'react';
 import { useSearchParams } from 'react-router-dom';
 
+const API_BASE_URL = process.env.REACT_APP_BACKEND_URL;
+const TERMINAL_STATUSES = ['success', 'failed', 'canceled'];
+
 const PaymentSuccess = () => {
   const [searchParams] = useSearchParams();
   const [paymentInfo, setPaymentInfo] = useState({});
+  const [liveStatus, setLiveStatus] = useState(null);
 
   useEffect(() => {
     // Extract payment information from URL parameters
@@ -14,6 +18,24 @@ const PaymentSuccess = () => {
     setPaymentInfo(info);
   }, [searchParams]);
 
+  useEffect(() => {
+    // Let the backend push status changes instead of polling for the webhook
+    const paymentId = searchParams.get('payment_id');
+    if (!paymentId || !window.EventSource) {
+      return undefined;
+    }
+    const source = new EventSource(`${API_BASE_URL}/api/payments/payments/${encodeURIComponent(paymentId)}/events`);
+    source.addEventListener('status', (event) => {
+      const { status } = JSON.parse(event.data);
+      setLiveStatus(status);
+      // The server ends the stream once the payment settles; don't reconnect
+      if (TERMINAL_STATUSES.includes(status)) {
+        source.close();
+      }
+    });
+    return () => source.close();
+  }, [searchParams]);
+
   return (
     <div style={{ 
       padding: '40px', 
@@ -35,6 +57,11 @@ const PaymentSuccess = () => {
         <p style={{ fontSize: '18px', color: '#155724', marginBottom: '20px' }}>
           Your payment has been processed successfully.
         </p>
+        {liveStatus && (
+          <p style={{ fontSize: '16px', color: '#155724', marginBottom: '20px' }}>
+            <strong>Current status:</strong> {liveStatus}
+          </p>
+        )}
         
         {Object.keys(paymentInfo).length > 0 && (
           <div style={{ 
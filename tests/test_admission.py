@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionController, AdmissionRejected
+
+async def hold(controller, release: asyncio.Event, started: list):
+    async with controller.admit():
+        started.append(controller.in_flight)
+        await release.wait()
+
+def test_limits_concurrency_and_queues_the_rest():
+    async def scenario():
+        controller = AdmissionController("dodo", max_concurrency=2, max_queue=5)
+        release = asyncio.Event()
+        started = []
+        tasks = [asyncio.create_task(hold(controller, release, started)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        during = (controller.in_flight, controller.queued, len(started))
+        release.set()
+        await asyncio.gather(*tasks)
+        return controller, during, started
+
+    controller, during, started = asyncio.run(scenario())
+    assert during == (2, 1, 2)
+    assert max(started) == 2
+    assert controller.admitted == 3
+    assert (controller.in_flight, controller.queued, controller.rejected) == (0, 0, 0)
+
+def test_full_queue_is_shed_immediately():
+    async def scenario():
+        controller = AdmissionController("dodo", max_concurrency=1, max_queue=1)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(controller, release, [])) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as exc_info:
+            async with controller.admit():
+                pass
+        release.set()
+        await asyncio.gather(*tasks)
+        return controller, exc_info.value
+
+    controller, rejected = asyncio.run(scenario())
+    assert rejected.reason == "queue_full"
+    assert rejected.retry_after >= 1
+    assert controller.rejected == 1
+    assert controller.admitted == 2
+
+def test_queue_timeout_rejects_without_leaking_the_permit():
+    async def scenario():
+        controller = AdmissionController("dodo", max_concurrency=1, max_queue=1, queue_timeout=0.05)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(controller, release, []))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as exc_info:
+            async with controller.admit():
+                pass
+        release.set()
+        await holder
+        # The slot must be usable again once the holder is done
+        async with controller.admit():
+            pass
+        return controller, exc_info.value
+
+    controller, rejected = asyncio.run(scenario())
+    assert rejected.reason == "queue_timeout"
+    assert (controller.in_flight, controller.queued) == (0, 0)
+    assert controller.admitted == 2
+
+def test_cancelled_waiter_releases_its_place():
+    async def scenario():
+        controller = AdmissionController("dodo", max_concurrency=1)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(controller, release, []))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(hold(controller, asyncio.Event(), []))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        release.set()
+        await holder
+        async with controller.admit():
+            pass
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert (controller.in_flight, controller.queued, controller.rejected) == (0, 0, 0)
+
+def test_unbounded_controller_never_sheds():
+    async def scenario():
+        controller = AdmissionController("background", max_concurrency=1)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(controller, release, [])) for _ in range(20)]
+        await asyncio.sleep(0.01)
+        queued = controller.queued
+        release.set()
+        await asyncio.gather(*tasks)
+        return controller, queued
+
+    controller, queued = asyncio.run(scenario())
+    assert queued == 19
+    assert controller.admitted == 20
+    assert controller.rejected == 0
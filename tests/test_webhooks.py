@@ -0,0 +1,101 @@
+import hmac
+import time
+import base64
+import asyncio
+import hashlib
+
+import pytest
+
+from services.webhooks import WebhookVerifier, WebhookVerificationError, read_limited_body
+
+SECRET = "whsec_" + base64.b64encode(b"current-signing-key").decode()
+OLD_SECRET = "whsec_" + base64.b64encode(b"previous-signing-key").decode()
+WEBHOOK_ID = "msg_123"
+BODY = b'{"type": "payment.succeeded", "data": {"payment_id": "pay_123"}}'
+
+def sign(secret: str, body: bytes = BODY, webhook_id: str = WEBHOOK_ID, timestamp: str = "1700000000") -> str:
+    key = base64.b64decode(secret[len("whsec_"):])
+    digest = hmac.new(key, f"{webhook_id}.{timestamp}.".encode() + body, hashlib.sha256).digest()
+    return f"v1,{base64.b64encode(digest).decode()}"
+
+class FakeRequest:
+    def __init__(self, chunks, content_length=None):
+        self.chunks = chunks
+        self.headers = {} if content_length is None else {"content-length": str(content_length)}
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+def test_valid_v1_signature():
+    WebhookVerifier([SECRET]).verify(BODY, sign(SECRET), WEBHOOK_ID, "1700000000")
+
+def test_rotated_secret_accepts_old_and_new_signatures():
+    verifier = WebhookVerifier([SECRET, OLD_SECRET])
+    verifier.verify(BODY, sign(SECRET), WEBHOOK_ID, "1700000000")
+    verifier.verify(BODY, sign(OLD_SECRET), WEBHOOK_ID, "1700000000")
+
+def test_retired_secret_is_rejected():
+    with pytest.raises(WebhookVerificationError) as exc_info:
+        WebhookVerifier([SECRET]).verify(BODY, sign(OLD_SECRET), WEBHOOK_ID, "1700000000")
+    assert exc_info.value.status_code == 401
+    assert exc_info.value.reason == "invalid_signature"
+
+def test_multi_signature_header_matches_any_entry():
+    header = f"v1,{base64.b64encode(b'x' * 32).decode()} {sign(SECRET)} v2,ignored"
+    WebhookVerifier([SECRET]).verify(BODY, header, WEBHOOK_ID, "1700000000")
+
+def test_legacy_hex_signature():
+    secret = "plain-shared-secret"
+    digest = hmac.new(secret.encode(), f"{WEBHOOK_ID}.1700000000.".encode() + BODY, hashlib.sha256).hexdigest()
+    WebhookVerifier([secret]).verify(BODY, digest, WEBHOOK_ID, "1700000000")
+
+def test_tampered_body_is_rejected():
+    with pytest.raises(WebhookVerificationError) as exc_info:
+        WebhookVerifier([SECRET]).verify(BODY.replace(b"pay_123", b"pay_999"), sign(SECRET), WEBHOOK_ID, "1700000000")
+    assert exc_info.value.reason == "invalid_signature"
+
+def test_signature_is_bound_to_webhook_id_and_timestamp():
+    verifier = WebhookVerifier([SECRET])
+    with pytest.raises(WebhookVerificationError):
+        verifier.verify(BODY, sign(SECRET), "msg_other", "1700000000")
+    with pytest.raises(WebhookVerificationError):
+        verifier.verify(BODY, sign(SECRET), WEBHOOK_ID, "1700000001")
+
+def test_no_secrets_rejects_everything():
+    verifier = WebhookVerifier([])
+    assert not verifier.configured
+    with pytest.raises(WebhookVerificationError):
+        verifier.verify(BODY, sign(SECRET), WEBHOOK_ID, "1700000000")
+
+def test_stale_timestamp_is_rejected():
+    verifier = WebhookVerifier([SECRET], tolerance_seconds=300)
+    now = time.time()
+    verifier.check_timestamp(str(int(now) - 299), now=now)
+    for timestamp in (int(now) - 301, int(now) + 301):
+        with pytest.raises(WebhookVerificationError) as exc_info:
+            verifier.check_timestamp(str(timestamp), now=now)
+        assert exc_info.value.status_code == 401
+        assert exc_info.value.reason == "stale_timestamp"
+
+def test_malformed_timestamp_is_rejected():
+    with pytest.raises(WebhookVerificationError) as exc_info:
+        WebhookVerifier([SECRET]).check_timestamp("yesterday")
+    assert exc_info.value.status_code == 400
+
+def test_oversized_body_is_rejected_from_content_length():
+    request = FakeRequest([b"x" * 10], content_length=2048)
+    with pytest.raises(WebhookVerificationError) as exc_info:
+        asyncio.run(read_limited_body(request, max_bytes=1024))
+    assert exc_info.value.status_code == 413
+
+def test_oversized_body_is_rejected_while_streaming():
+    # A missing or understated Content-Length must not bypass the limit
+    request = FakeRequest([b"x" * 600, b"x" * 600], content_length=10)
+    with pytest.raises(WebhookVerificationError) as exc_info:
+        asyncio.run(read_limited_body(request, max_bytes=1024))
+    assert exc_info.value.reason == "body_too_large"
+
+def test_body_within_limit_is_returned_whole():
+    request = FakeRequest([BODY[:20], BODY[20:]])
+    assert asyncio.run(read_limited_body(request, max_bytes=1024)) == BODY
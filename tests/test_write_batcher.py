@@ -0,0 +1,99 @@
+import asyncio
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from services.write_batcher import BulkWriteBatcher
+
+class FakeCollection:
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    async def bulk_write(self, requests, ordered=True):
+        self.calls.append((requests, ordered))
+        if self.error is not None:
+            raise self.error
+
+def test_concurrent_submits_share_one_bulk_write():
+    async def scenario():
+        collection = FakeCollection()
+        batcher = BulkWriteBatcher(collection, "payment_id", max_delay=0.01)
+        results = await asyncio.gather(*[
+            batcher.submit(f"pay_{index}", {"status": "success"}) for index in range(5)
+        ])
+        return collection, batcher, results
+
+    collection, batcher, results = asyncio.run(scenario())
+    assert results == [True] * 5
+    assert len(collection.calls) == 1
+    requests, ordered = collection.calls[0]
+    assert not ordered
+    assert len(requests) == 5
+    assert batcher.get_stats()["avg_batch_size"] == 5
+
+def test_updates_to_the_same_document_are_merged_in_order():
+    async def scenario():
+        collection = FakeCollection()
+        batcher = BulkWriteBatcher(collection, "payment_id", max_delay=0.01)
+        first = batcher.submit("pay_1", {"status": "pending", "note": "a"})
+        second = batcher.submit("pay_1", {"status": "success"})
+        return collection, await asyncio.gather(first, second)
+
+    collection, results = asyncio.run(scenario())
+    assert results == [True, True]
+    assert collection.calls[0][0] == [
+        UpdateOne({"payment_id": "pay_1"}, {"$set": {"status": "success", "note": "a"}})
+    ]
+
+def test_full_batch_flushes_without_waiting_for_the_delay():
+    async def scenario():
+        collection = FakeCollection()
+        batcher = BulkWriteBatcher(collection, "payment_id", max_batch=2, max_delay=60)
+        futures = [batcher.submit("pay_1", {"status": "success"}), batcher.submit("pay_2", {"status": "failed"})]
+        return collection, await asyncio.wait_for(asyncio.gather(*futures), timeout=1)
+
+    collection, results = asyncio.run(scenario())
+    assert results == [True, True]
+    assert len(collection.calls) == 1
+
+def test_write_errors_fail_only_their_own_updates():
+    error = BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "duplicate key"}]})
+
+    async def scenario():
+        batcher = BulkWriteBatcher(FakeCollection(error), "payment_id", max_delay=0.01)
+        return await asyncio.gather(
+            batcher.submit("pay_1", {"status": "success"}),
+            batcher.submit("pay_2", {"status": "success"}),
+            return_exceptions=True
+        )
+
+    ok, failed = asyncio.run(scenario())
+    assert ok is True
+    assert isinstance(failed, Exception)
+    assert "duplicate key" in str(failed)
+
+def test_connection_errors_fail_every_update():
+    async def scenario():
+        batcher = BulkWriteBatcher(FakeCollection(ConnectionError("down")), "payment_id", max_delay=0.01)
+        return await asyncio.gather(
+            batcher.submit("pay_1", {"status": "success"}),
+            batcher.submit("pay_2", {"status": "success"}),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+def test_flush_writes_pending_updates_immediately():
+    async def scenario():
+        collection = FakeCollection()
+        batcher = BulkWriteBatcher(collection, "payment_id", max_delay=60)
+        future = batcher.submit("pay_1", {"status": "success"})
+        await batcher.flush()
+        return collection, future, batcher
+
+    collection, future, batcher = asyncio.run(scenario())
+    assert future.result() is True
+    assert len(collection.calls) == 1
+    assert batcher.get_stats()["pending"] == 0